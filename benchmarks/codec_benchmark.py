@@ -0,0 +1,79 @@
+"""
+compare the BinaryCodec with pickle on the stored payloads
+
+usage: PYTHONPATH=src python benchmarks/codec_benchmark.py
+"""
+import pickle
+import timeit
+from datetime import datetime
+
+from wechaty_puppet_official_account.codec import default_codec
+from wechaty_puppet_official_account.schema import (
+    OAMessagePayload,
+    OAContactPayload,
+    AccessTokenPayload
+)
+
+RECORDS = {
+    'OAMessagePayload': OAMessagePayload(
+        ToUserName='gh_1234567890ab',
+        FromUserName='oLVPpjqs9BhvzwPj5A-vTYAX3GLc',
+        CreateTime='1600000000',
+        MsgType='text',
+        Content='你好，wechaty',
+        MsgId='22871565829087124'
+    ),
+    'OAContactPayload': OAContactPayload(
+        subscribe=1,
+        openid='oLVPpjqs9BhvzwPj5A-vTYAX3GLc',
+        nickname='wechaty',
+        sex=1,
+        language='zh_CN',
+        city='Beijing',
+        province='Beijing',
+        country='China',
+        headimgurl='http://thirdwx.qlogo.cn/mmopen/g3MonUZtNHkdmzicIlibx6iaFqAc56vxLSUfpb6n5WKSYVY0ChQKkiaJSgQ1dZuTOgvLLrhJbERQQ4eMsv84eavHiaiceqxibJxCfHe/0',
+        subscribe_time=1600000000,
+        unionid='o6_bmasdasdsad6_2sgVt7hMZOPfL',
+        remark='',
+        groupid=0,
+        tagid_list=[128, 2],
+        subscribe_scene='ADD_SCENE_QR_CODE',
+        qr_scene=98765,
+        qr_scene_str=''
+    ),
+    'AccessTokenPayload': AccessTokenPayload(
+        expires_in=7200,
+        refresh_time=datetime.now(),
+        token='ACCESS_TOKEN' * 10
+    ),
+}
+
+
+def main():
+    """print the size and the throughput of the codecs"""
+    codec = default_codec()
+    number = 20000
+
+    print(f'{"record":<20} {"codec":<8} {"bytes":>6} {"encode/s":>10} {"decode/s":>10}')
+    for name, record in RECORDS.items():
+        pickled = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        encoded = codec.encode(record)
+        assert codec.decode(encoded) == record
+
+        cases = [
+            ('pickle', pickled,
+             lambda: pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL),
+             lambda: pickle.loads(pickled)),
+            ('binary', encoded,
+             lambda: codec.encode(record),
+             lambda: codec.decode(encoded)),
+        ]
+        for codec_name, data, encode, decode in cases:
+            encode_rate = number / timeit.timeit(encode, number=number)
+            decode_rate = number / timeit.timeit(decode, number=number)
+            print(f'{name:<20} {codec_name:<8} {len(data):>6} {encode_rate:>10.0f} {decode_rate:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+measure the queries of the indexed message log
+
+usage: PYTHONPATH=src python benchmarks/message_log_benchmark.py
+"""
+import tempfile
+import timeit
+
+from wechaty_puppet_official_account.message_log import MessageLog
+from wechaty_puppet_official_account.schema import OAMessagePayload
+
+MSG_TYPES = ['text', 'text', 'text', 'image', 'voice', 'video', 'shortvideo', 'location']
+
+
+def main():
+    """print the latency of the queries on 100k messages from 1k users"""
+    messages, users, number = 100000, 1000, 2000
+
+    with tempfile.TemporaryDirectory() as directory:
+        message_log = MessageLog(directory)
+        for msg_id in range(messages):
+            message_log.append(OAMessagePayload(
+                ToUserName='gh_1234567890ab',
+                FromUserName=f'openid-{msg_id % users}',
+                CreateTime=str(1600000000 + msg_id),
+                MsgType=MSG_TYPES[msg_id % len(MSG_TYPES)],
+                Content=f'content-{msg_id}',
+                MsgId=str(msg_id)
+            ))
+
+        middle = 1600000000 + messages // 2
+        cases = [
+            ('openid', lambda: message_log.search(from_user='openid-7')),
+            ('openid + time', lambda: message_log.search(
+                from_user='openid-7', since=middle, until=middle + 10000)),
+            ('time range (100)', lambda: message_log.search(since=middle, until=middle + 99)),
+            ('openid + video types', lambda: message_log.search(
+                from_user='openid-5', msg_type=['video', 'shortvideo'])),
+            ('video types', lambda: message_log.search(msg_type=['video', 'shortvideo'])),
+        ]
+
+        print(f'{messages} messages from {users} users')
+        print(f'{"query":<24} {"results":>8} {"us / query":>12}')
+        for name, query in cases:
+            seconds = timeit.timeit(query, number=number)
+            print(f'{name:<24} {len(query()):>8} {seconds / number * 1e6:>12.1f}')
+        message_log.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+measure the dispatch cost of the routing table with growing rules
+
+usage: PYTHONPATH=src python benchmarks/router_benchmark.py
+"""
+import timeit
+
+from wechaty_puppet_official_account.router import Router
+
+
+async def _handler(_):
+    return None
+
+
+def build(size: int) -> Router:
+    """build the router with `size` rules of each kind"""
+    router = Router()
+    for index in range(size):
+        router.keyword(f'keyword-{index}', _handler)
+        router.prefix(f'prefix-{index}-', _handler)
+        router.regex(rf'order-{index}-\d+$', _handler)
+        # no literal prefix, all of them are in the root bucket
+        router.regex(rf'(?i:refund)-{index}-\d+$', _handler)
+        router.event('CLICK', _handler, key=f'MENU_{index}')
+    router.compile()
+    return router
+
+
+def main():
+    """print the microseconds per dispatch"""
+    number = 20000
+    texts = {
+        'keyword': 'keyword-{}',
+        'prefix': 'prefix-{}-hello wechaty',
+        'regex': 'order-{}-20200101',
+        'root': 'REFUND-{}-20200101',
+        'miss': 'nothing matches {}',
+    }
+    print(f'{"rules":>6} ' + ' '.join(f'{name:>9}' for name in texts) + '  (us / dispatch)')
+    for size in [10, 100, 1000, 10000]:
+        router = build(size)
+        costs = []
+        for template in texts.values():
+            text = template.format(size - 1)
+            assert router.match_text(text) is (None if 'nothing' in text else _handler)
+            seconds = timeit.timeit(lambda: router.match_text(text), number=number)
+            costs.append(seconds / number * 1e6)
+        print(f'{size:>6} ' + ' '.join(f'{cost:>9.2f}' for cost in costs))
+
+
+if __name__ == '__main__':
+    main()
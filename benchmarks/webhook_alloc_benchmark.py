@@ -0,0 +1,108 @@
+"""
+compare the per-request allocations of the webhook hot path with the previous
+implementation, while the debug logging is off
+
+usage: PYTHONPATH=src python benchmarks/webhook_alloc_benchmark.py
+"""
+import asyncio
+import hashlib
+import logging
+import time
+import tracemalloc
+from typing import Mapping, Optional
+
+import xmltodict
+from multidict import MultiDict, MultiDictProxy
+
+from wechaty_puppet_official_account.schema import VerifyArgs
+from wechaty_puppet_official_account.webhook import (
+    Webhook,
+    WebhookOptions,
+    logger,
+    parse_payload
+)
+
+TOKEN = 'token'
+BODY = (
+    '<xml><ToUserName><![CDATA[gh_1234567890ab]]></ToUserName>'
+    '<FromUserName><![CDATA[oLVPpjqs9BhvzwPj5A-vTYAX3GLc]]></FromUserName>'
+    '<CreateTime>1600000000</CreateTime><MsgType><![CDATA[text]]></MsgType>'
+    '<Content><![CDATA[' + '你好，wechaty ' * 20 + ']]></Content>'
+    '<MsgId>22871565829087124</MsgId></xml>'
+).encode('utf-8')
+
+
+def _query() -> MultiDictProxy:
+    timestamp, nonce = '1600000000', '1234567'
+    signature = hashlib.sha1(''.join(sorted([TOKEN, timestamp, nonce])).encode()).hexdigest()
+    return MultiDictProxy(MultiDict(
+        signature=signature, timestamp=timestamp, nonce=nonce, echostr='echostr'
+    ))
+
+
+class PreviousWebhook(Webhook):
+    """the hot path before reworking, with the signature fixed to be comparable"""
+
+    def verify_auth(self, query: Mapping[str, str]) -> str:
+        query_json = dict(query)
+        logger.debug('receive query from tencent server <%s>', query)
+        verify_args = VerifyArgs(**query_json)
+        data = sorted([verify_args.timestamp, verify_args.nonce, self.options.token])
+        hash_data = hashlib.sha1(''.join(data).encode()).hexdigest()
+        text = verify_args.echostr if hash_data == verify_args.signature else ''
+        logger.debug(f'final auth text result : {text}')
+        return text
+
+    async def receive_message(self, body: bytes) -> Optional[str]:
+        # request.text() decodes the body into str
+        data = body.decode('utf-8')
+        logger.debug(f'receive message <{data}>')
+        payload = parse_payload(xmltodict.parse(data)['xml'])
+        self.emit('message', payload)
+        await self.router.dispatch(payload)
+        return None
+
+
+def measure(webhook: Webhook, number: int = 2000) -> float:
+    """the average peak of the traced memory per request in bytes"""
+    query = _query()
+    loop = asyncio.new_event_loop()
+
+    def request():
+        assert webhook.verify_auth(query) == 'echostr'
+        loop.run_until_complete(webhook.receive_message(BODY))
+
+    # warm up the caches
+    for _ in range(100):
+        request()
+
+    tracemalloc.start()
+    total = 0
+    for _ in range(number):
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        request()
+        total += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    loop.close()
+    return total / number
+
+
+def main():
+    """print the allocations and the time per request"""
+    logging.disable(logging.INFO)
+    options = WebhookOptions(port=80, token=TOKEN)
+    for name, webhook in [('previous', PreviousWebhook(options)), ('current', Webhook(options))]:
+        peak = measure(webhook)
+        started = time.perf_counter()
+        query, loop = _query(), asyncio.new_event_loop()
+        for _ in range(5000):
+            webhook.verify_auth(query)
+            loop.run_until_complete(webhook.receive_message(BODY))
+        cost = (time.perf_counter() - started) / 5000 * 1e6
+        loop.close()
+        print(f'{name:<10} peak allocation {peak:>8.0f} bytes / request, {cost:>6.1f} us / request')
+
+
+if __name__ == '__main__':
+    main()
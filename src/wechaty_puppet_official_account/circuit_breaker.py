@@ -0,0 +1,179 @@
+"""
+Python Wechaty - https://github.com/wechaty/python-wechaty
+
+Authors:    Jingjing WU (吴京京) <https://github.com/wj-Mcat>
+
+2020-now @ Copyright Wechaty
+
+Licensed under the Apache License, Version 2.0 (the 'License');
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an 'AS IS' BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from wechaty_puppet import get_logger, WechatyPuppetError
+
+logger = get_logger('CircuitBreaker')
+
+T = TypeVar('T')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(WechatyPuppetError):
+    """the request is rejected without calling the api"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f'circuit <{name}> is open, retry after {retry_after:.1f}s')
+        self.retry_after: float = retry_after
+
+
+@dataclass
+class CircuitBreakerOption:
+    # the circuit opens after the consecutive failures
+    failure_threshold: int = 5
+    # seconds to wait before probing the api in the open state
+    recovery_timeout: float = 30.0
+    # seconds of each call, the timeout is counted as failure
+    timeout: float = 10.0
+    # the number of the probing calls in the half-open state
+    half_open_max_calls: int = 1
+
+
+class CircuitBreaker:
+    """
+    closed -> open: after failure_threshold consecutive failures
+    open -> half_open: after recovery_timeout, some probing calls are allowed
+    half_open -> closed: the probing call succeeds
+    half_open -> open: the probing call fails
+
+    before_call, record_success & record_failure are thread safe, so that the
+    blocking calls in the executor can be guarded without `call`.
+    """
+
+    def __init__(self, name: str, option: Optional[CircuitBreakerOption] = None):
+        if not option:
+            option = CircuitBreakerOption()
+        self.name: str = name
+        self.option: CircuitBreakerOption = option
+
+        self.state: str = CLOSED
+        self._failures: int = 0
+        self._opened_at: float = 0
+        self._probing: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    @property
+    def retry_after(self) -> float:
+        """seconds until the open circuit allows the probing call"""
+        if self.state != OPEN:
+            return 0
+        return max(0.0, self._opened_at + self.option.recovery_timeout - time.monotonic())
+
+    @property
+    def is_open(self) -> bool:
+        """check if the calls are rejected without probing the api"""
+        return self.state == OPEN and self.retry_after > 0
+
+    def before_call(self):
+        """check if the call is allowed, or raise CircuitOpenError"""
+        with self._lock:
+            self._before_call()
+
+    def _before_call(self):
+        if self.state == OPEN:
+            if self.retry_after > 0:
+                raise CircuitOpenError(self.name, self.retry_after)
+            logger.info('circuit <%s> is half open', self.name)
+            self.state = HALF_OPEN
+            self._probing = 0
+
+        if self.state == HALF_OPEN:
+            if self._probing >= self.option.half_open_max_calls:
+                raise CircuitOpenError(self.name, self.option.recovery_timeout)
+            self._probing += 1
+
+    def record_success(self):
+        """the call succeeds"""
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info('circuit <%s> is closed', self.name)
+            self.state = CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        """the call fails"""
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or self._failures >= self.option.failure_threshold:
+                if self.state != OPEN:
+                    logger.warning('circuit <%s> is open after <%d> failures', self.name, self._failures)
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+    async def call(self, func: Callable[[], Awaitable[T]],
+                   is_failure: Optional[Callable[[T], bool]] = None) -> T:
+        """
+        call the api with timeout, the exceptions and the results which
+        `is_failure` returns True are counted as failures
+        """
+        self.before_call()
+        try:
+            result = await asyncio.wait_for(func(), timeout=self.option.timeout)
+        except asyncio.CancelledError:
+            # the caller is cancelled, which tells nothing about the api
+            with self._lock:
+                if self.state == HALF_OPEN:
+                    self._probing -= 1
+            raise
+        except asyncio.TimeoutError as error:
+            self.record_failure()
+            raise WechatyPuppetError(f'circuit <{self.name}> call timeout after {self.option.timeout}s') from error
+        except Exception:
+            self.record_failure()
+            raise
+
+        if is_failure and is_failure(result):
+            self.record_failure()
+        else:
+            self.record_success()
+        return result
+
+
+class CircuitBreakers:
+    """the circuit breakers of the api families, eg: message, qrcode, token"""
+
+    def __init__(self, option: Optional[CircuitBreakerOption] = None):
+        self.option: Optional[CircuitBreakerOption] = option
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, family: str) -> CircuitBreaker:
+        """get the circuit breaker of the api family"""
+        breaker = self._breakers.get(family, None)
+        if breaker is None:
+            breaker = self._breakers[family] = CircuitBreaker(family, self.option)
+        return breaker
+
+    def for_path(self, path: str) -> CircuitBreaker:
+        """get the circuit breaker by api path, eg: message/custom/send -> message"""
+        return self.get(path.split('/', 1)[0])
+
+    def states(self) -> Dict[str, Any]:
+        """the states of the circuit breakers"""
+        return {family: breaker.state for family, breaker in self._breakers.items()}
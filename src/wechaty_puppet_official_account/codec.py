@@ -0,0 +1,563 @@
+"""
+Python Wechaty - https://github.com/wechaty/python-wechaty
+
+Authors:    Jingjing WU (吴京京) <https://github.com/wj-Mcat>
+
+2020-now @ Copyright Wechaty
+
+Licensed under the Apache License, Version 2.0 (the 'License');
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an 'AS IS' BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from __future__ import annotations
+
+import pickle
+import struct
+from dataclasses import fields
+from datetime import datetime
+from enum import Enum
+from typing import (
+    Any, Callable, Dict, List, Literal, NamedTuple, Optional, Tuple, Type,
+    get_args, get_origin, get_type_hints
+)
+
+from wechaty_puppet import WechatyPuppetOperationError
+
+from .schema import OAMessagePayload, OAContactPayload, AccessTokenPayload
+
+
+class Codec:
+    """serialize the value which is stored in the DataStore"""
+
+    def encode(self, value: Any) -> bytes:
+        """encode the value into bytes"""
+        raise NotImplementedError
+
+    def decode(self, data: bytes) -> Any:
+        """decode the value, which is upgraded to the latest schema version"""
+        raise NotImplementedError
+
+    def is_stale(self, data: bytes) -> bool:
+        """check if the encoded value is not in the latest schema version"""
+        return False
+
+
+class PickleCodec(Codec):
+    """the pickle codec, which is what diskcache does by default"""
+
+    def encode(self, value: Any) -> bytes:
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data: bytes) -> Any:
+        return pickle.loads(data)
+
+
+Upgrader = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+_MAGIC = 0xB7
+# the magic of the records written by the compiled layouts of the dataclasses
+_COMPILED_MAGIC = 0xB8
+# magic | type tag | schema version | field count
+_COMPILED_HEADER = struct.Struct('<BBBB')
+_HEADER = struct.Struct('<BBB')
+_DOUBLE = struct.Struct('<d')
+
+# value markers
+_NONE, _FALSE, _TRUE, _INT, _NEG_INT, _FLOAT, _STR, _BYTES, _LIST, _DICT, _DATETIME = range(11)
+
+# type tag of the plain values, eg: str, dict, list
+_PLAIN_TAG = 0
+
+
+def _write_uint(buffer: bytearray, number: int):
+    """write the unsigned varint"""
+    while number > 0x7F:
+        buffer.append((number & 0x7F) | 0x80)
+        number >>= 7
+    buffer.append(number)
+
+
+def _read_uint(data: bytes, offset: int) -> Tuple[int, int]:
+    """read the unsigned varint, returns the number and the next offset"""
+    byte = data[offset]
+    if byte < 0x80:
+        return byte, offset + 1
+    number, shift = 0, 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        number |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return number, offset
+        shift += 7
+
+
+def _write_str(buffer: bytearray, value: str):
+    data = value.encode('utf-8')
+    buffer.append(_STR)
+    _write_uint(buffer, len(data))
+    buffer += data
+
+
+def _write_int(buffer: bytearray, value: int):
+    if value >= 0:
+        buffer.append(_INT)
+        _write_uint(buffer, value)
+    else:
+        buffer.append(_NEG_INT)
+        _write_uint(buffer, -value)
+
+
+def _write_bool(buffer: bytearray, value: bool):
+    buffer.append(_TRUE if value else _FALSE)
+
+
+def _write_none(buffer: bytearray, _: None):
+    buffer.append(_NONE)
+
+
+def _write_float(buffer: bytearray, value: float):
+    buffer.append(_FLOAT)
+    buffer += _DOUBLE.pack(value)
+
+
+def _write_datetime(buffer: bytearray, value: datetime):
+    buffer.append(_DATETIME)
+    buffer += _DOUBLE.pack(value.timestamp())
+
+
+def _write_bytes(buffer: bytearray, value: bytes):
+    buffer.append(_BYTES)
+    _write_uint(buffer, len(value))
+    buffer += value
+
+
+def _write_list(buffer: bytearray, value: list):
+    buffer.append(_LIST)
+    _write_uint(buffer, len(value))
+    for item in value:
+        _write(buffer, item)
+
+
+def _write_dict(buffer: bytearray, value: dict):
+    buffer.append(_DICT)
+    _write_uint(buffer, len(value))
+    for key, item in value.items():
+        _write(buffer, key)
+        _write(buffer, item)
+
+
+_WRITERS: Dict[type, Callable[[bytearray, Any], None]] = {
+    str: _write_str,
+    int: _write_int,
+    bool: _write_bool,
+    type(None): _write_none,
+    float: _write_float,
+    datetime: _write_datetime,
+    bytes: _write_bytes,
+    bytearray: _write_bytes,
+    list: _write_list,
+    tuple: _write_list,
+    dict: _write_dict,
+}
+
+
+def _write(buffer: bytearray, value: Any):
+    writer = _WRITERS.get(type(value), None)
+    if writer is None:
+        # the subclasses, eg: IntEnum
+        for value_type, value_writer in _WRITERS.items():
+            if isinstance(value, value_type):
+                writer = value_writer
+                break
+        else:
+            raise WechatyPuppetOperationError(f'can not encode the value <{value!r}>')
+    writer(buffer, value)
+
+
+def _read_str(data: bytes, offset: int) -> Tuple[str, int]:
+    size, offset = _read_uint(data, offset)
+    end = offset + size
+    return data[offset:end].decode('utf-8'), end
+
+
+def _read_neg_int(data: bytes, offset: int) -> Tuple[int, int]:
+    number, offset = _read_uint(data, offset)
+    return -number, offset
+
+
+def _read_float(data: bytes, offset: int) -> Tuple[float, int]:
+    return _DOUBLE.unpack_from(data, offset)[0], offset + _DOUBLE.size
+
+
+def _read_datetime(data: bytes, offset: int) -> Tuple[datetime, int]:
+    timestamp = _DOUBLE.unpack_from(data, offset)[0]
+    return datetime.fromtimestamp(timestamp), offset + _DOUBLE.size
+
+
+def _read_bytes(data: bytes, offset: int) -> Tuple[bytes, int]:
+    size, offset = _read_uint(data, offset)
+    end = offset + size
+    return bytes(data[offset:end]), end
+
+
+def _read_list(data: bytes, offset: int) -> Tuple[list, int]:
+    size, offset = _read_uint(data, offset)
+    items = []
+    for _ in range(size):
+        item, offset = _read(data, offset)
+        items.append(item)
+    return items, offset
+
+
+def _read_dict(data: bytes, offset: int) -> Tuple[dict, int]:
+    size, offset = _read_uint(data, offset)
+    mapping = {}
+    for _ in range(size):
+        key, offset = _read(data, offset)
+        mapping[key], offset = _read(data, offset)
+    return mapping, offset
+
+
+# the readers are indexed by the value markers
+_READERS: List[Callable[[bytes, int], Tuple[Any, int]]] = [
+    lambda data, offset: (None, offset),
+    lambda data, offset: (False, offset),
+    lambda data, offset: (True, offset),
+    _read_uint,
+    _read_neg_int,
+    _read_float,
+    _read_str,
+    _read_bytes,
+    _read_list,
+    _read_dict,
+    _read_datetime,
+]
+
+
+def _read(data: bytes, offset: int) -> Tuple[Any, int]:
+    """read the value, returns the value and the next offset"""
+    marker = data[offset]
+    if marker >= len(_READERS):
+        raise WechatyPuppetOperationError(f'unknown value marker <{marker}>')
+    return _READERS[marker](data, offset + 1)
+
+
+# the kinds of the fields in the compiled layout
+_KIND_INT, _KIND_FLOAT, _KIND_DATETIME, _KIND_STR, _KIND_ANY = b'ifts?'
+
+
+def _field_kind(hint: Any) -> Tuple[int, Optional[Type[Enum]]]:
+    """get the kind of the field by type hint, and the enum type to convert on decoding"""
+    if get_origin(hint) is Literal:
+        return (_KIND_STR if all(isinstance(arg, str) for arg in get_args(hint)) else _KIND_ANY), None
+    if not isinstance(hint, type) or hint is bool:
+        return _KIND_ANY, None
+    if issubclass(hint, Enum):
+        if issubclass(hint, int):
+            return _KIND_INT, hint
+        if issubclass(hint, str):
+            return _KIND_STR, hint
+        return _KIND_ANY, None
+    if issubclass(hint, int):
+        return _KIND_INT, None
+    if issubclass(hint, float):
+        return _KIND_FLOAT, None
+    if issubclass(hint, datetime):
+        return _KIND_DATETIME, None
+    if issubclass(hint, str):
+        return _KIND_STR, None
+    return _KIND_ANY, None
+
+
+def _compile(name: str, lines: List[str], namespace: Dict[str, Any]) -> Callable:
+    """compile the function from the source lines, like what dataclasses does for __init__"""
+    exec('\n'.join(lines), namespace)  # pylint: disable=exec-used
+    return namespace[name]
+
+
+class _Layout:
+    """
+    the layout of the dataclass fields grouped by kind:
+
+    struct(int & float fields, datetime fields, str end offsets, text size) | utf-8 text | other values
+
+    the encoder & decoder are compiled into straight-line functions of the fields
+    """
+
+    def __init__(self, names: List[str], shape: bytes, enums: Dict[str, Type[Enum]]):
+        kinds = dict(zip(names, shape))
+        fixed_names = [name for name in names if kinds[name] == _KIND_INT] + \
+            [name for name in names if kinds[name] == _KIND_FLOAT]
+        datetime_names = [name for name in names if kinds[name] == _KIND_DATETIME]
+        str_names = [name for name in names if kinds[name] == _KIND_STR]
+        any_names = [name for name in names if kinds[name] == _KIND_ANY]
+
+        layout = struct.Struct(
+            '<' + ''.join('q' if kinds[name] == _KIND_INT else 'd' for name in fixed_names + datetime_names)
+            + 'I' * (len(str_names) + 1)
+        )
+        namespace: Dict[str, Any] = {
+            'pack': layout.pack,
+            'unpack_from': layout.unpack_from,
+            'write': _write,
+            'read': _read,
+            'fromtimestamp': datetime.fromtimestamp,
+            'Error': WechatyPuppetOperationError,
+        }
+        for name, enum in enums.items():
+            namespace[f'enum_{name}'] = enum
+
+        # the index of the values in the struct
+        index = {name: position for position, name in enumerate(fixed_names + datetime_names + str_names)}
+        text_index = len(index)
+
+        encoder = ['def encode(value):']
+        encoder += [f'    s{position} = value.{name}' for position, name in enumerate(str_names)]
+        encoder.append(f'    text = "".join(({"".join(f"s{position}, " for position in range(len(str_names)))}))'
+                       '.encode("utf-8")')
+        ends = []
+        for position in range(len(str_names)):
+            encoder.append(f'    e{position} = {f"e{position - 1} + " if position else ""}len(s{position})')
+            ends.append(f'e{position}')
+        encoder.append('    head = pack(' + ''.join(
+            [f'value.{name}, ' for name in fixed_names]
+            + [f'value.{name}.timestamp(), ' for name in datetime_names]
+            + [f'{end}, ' for end in ends]
+        ) + 'len(text))')
+        if any_names:
+            encoder.append('    buffer = bytearray()')
+            encoder += [f'    write(buffer, value.{name})' for name in any_names]
+            encoder.append('    return head + text + buffer')
+        else:
+            encoder.append('    return head + text')
+
+        decoder = [
+            'def decode(data, offset):',
+            '    numbers = unpack_from(data, offset)',
+            f'    offset += {layout.size}',
+            f'    end = offset + numbers[{text_index}]',
+            '    text = data[offset:end].decode("utf-8")',
+            f'    if len(text) != {f"numbers[{index[str_names[-1]]}]" if str_names else "0"}:',
+            '        raise Error("the record is truncated")',
+        ]
+        values = []
+        for name in names:
+            kind = kinds[name]
+            if kind in (_KIND_INT, _KIND_FLOAT):
+                values.append(f'numbers[{index[name]}]')
+            elif kind == _KIND_DATETIME:
+                values.append(f'fromtimestamp(numbers[{index[name]}])')
+            elif kind == _KIND_STR:
+                position = str_names.index(name)
+                start = f'numbers[{index[str_names[position - 1]]}]' if position else '0'
+                values.append(f'text[{start}:numbers[{index[name]}]]')
+            if name in enums and kind != _KIND_ANY:
+                values[-1] = f'enum_{name}({values[-1]})'
+        decoder.append('    payload = {' + ', '.join(
+            f'{name!r}: {value}' for name, value in zip([name for name in names if name not in any_names], values)
+        ) + '}')
+        decoder.append('    offset = end')
+        for name in any_names:
+            decoder.append(f'    payload[{name!r}], offset = read(data, offset)')
+        decoder += [
+            '    if offset != len(data):',
+            '        raise Error("the record is truncated or has trailing bytes")',
+            '    return payload',
+        ]
+
+        self.encode: Callable[[Any], bytes] = _compile('encode', encoder, namespace)
+        self.decode: Callable[[bytes, int], Dict[str, Any]] = _compile('decode', decoder, namespace)
+
+
+class _Plan(NamedTuple):
+    """how to decode the records with the same header & shape"""
+    cls: Type
+    tag: int
+    version: int
+    layout: _Layout
+    # the dataclass in the latest version without enums & __post_init__ is
+    # restored by its __dict__, the same as unpickling
+    restore_dict: bool
+
+
+class BinaryCodec(Codec):
+    """
+    compact binary codec with schema version tag
+
+    record layout:
+        plain values:  magic | 0 | 0 | value
+        dataclass:     compiled magic | type tag | schema version | field count | shape | fields
+
+    the shape is the kind of each field in the declared order, which is
+    compiled from the type hints into one struct for int, float & datetime
+    fields, one utf-8 text for str fields, and the other fields, eg: Optional
+    & List, written value by value. The dataclass falls back to the layout of
+    the plain values, field by field, when the values do not match the hints.
+
+    the new fields must be appended to the end of the dataclass. The records
+    of the old versions are decoded with their own shapes, and upgraded by the
+    registered upgraders.
+    """
+
+    def __init__(self):
+        self._classes: Dict[int, Type] = {}
+        self._tags: Dict[Type, int] = {}
+        self._versions: Dict[int, int] = {}
+        self._field_names: Dict[int, List[str]] = {}
+        # tag -> the prefix of the records & the layout of the latest version
+        self._layouts: Dict[int, Tuple[bytes, _Layout]] = {}
+        # the prefix of the records, including the shape -> the plan of decoding them
+        self._plans: Dict[bytes, _Plan] = {}
+        # tag -> the enum fields, which are converted from the plain values on decoding
+        self._enums: Dict[int, Dict[str, Type[Enum]]] = {}
+        # (tag, from_version) -> upgrader which returns the fields of from_version + 1
+        self._upgraders: Dict[Tuple[int, int], Upgrader] = {}
+
+    def register(self, cls: Type, tag: int, version: int = 1):
+        """register the dataclass with the unique tag and the current schema version"""
+        if tag == _PLAIN_TAG or not 0 < tag < 256:
+            raise WechatyPuppetOperationError(f'tag <{tag}> should be in 1 ~ 255')
+        if tag in self._classes:
+            raise WechatyPuppetOperationError(f'tag <{tag}> is registered by <{self._classes[tag]}>')
+        if not 0 < version < 256:
+            raise WechatyPuppetOperationError(f'version <{version}> should be in 1 ~ 255')
+
+        names = [field.name for field in fields(cls)]
+        if len(names) > 255:
+            raise WechatyPuppetOperationError(f'<{cls.__name__}> should have at most 255 fields')
+        try:
+            hints = get_type_hints(cls)
+        except (NameError, TypeError):
+            hints = {}
+        kinds = [_field_kind(hints.get(name, Any)) for name in names]
+        shape = bytes(kind for kind, _ in kinds)
+
+        self._classes[tag] = cls
+        self._tags[cls] = tag
+        self._versions[tag] = version
+        self._field_names[tag] = names
+        self._enums[tag] = {name: enum for name, (_, enum) in zip(names, kinds) if enum is not None}
+        prefix = _COMPILED_HEADER.pack(_COMPILED_MAGIC, tag, version, len(shape)) + shape
+        self._layouts[tag] = (prefix, _Layout(names, shape, self._enums[tag]))
+
+    def register_upgrader(self, cls: Type, from_version: int, upgrader: Upgrader):
+        """register the upgrader which upgrades the fields from from_version to from_version + 1"""
+        self._upgraders[(self._tags[cls], from_version)] = upgrader
+
+    def encode(self, value: Any) -> bytes:
+        tag = self._tags.get(type(value), _PLAIN_TAG)
+        if tag == _PLAIN_TAG:
+            buffer = bytearray(_HEADER.pack(_MAGIC, _PLAIN_TAG, 0))
+            _write(buffer, value)
+            return bytes(buffer)
+
+        prefix, layout = self._layouts[tag]
+        try:
+            return prefix + layout.encode(value)
+        except (TypeError, AttributeError, struct.error):
+            # the values do not match the type hints, eg: None in the int field
+            buffer = bytearray(_HEADER.pack(_MAGIC, tag, self._versions[tag]))
+            names = self._field_names[tag]
+            _write_uint(buffer, len(names))
+            for name in names:
+                _write(buffer, getattr(value, name))
+            return bytes(buffer)
+
+    def decode(self, data: bytes) -> Any:
+        try:
+            if data[0] == _COMPILED_MAGIC:
+                prefix = data[:_COMPILED_HEADER.size + data[_COMPILED_HEADER.size - 1]]
+                plan = self._plans.get(prefix, None) or self._plan(prefix)
+                payload = plan.layout.decode(data, len(prefix))
+                if plan.restore_dict:
+                    instance = plan.cls.__new__(plan.cls)
+                    instance.__dict__ = payload
+                    return instance
+                return self._restore(plan.tag, plan.version, payload)
+            return self._decode_plain(data)
+        except (IndexError, struct.error, UnicodeDecodeError, ValueError) as error:
+            raise WechatyPuppetOperationError(f'the record is truncated or corrupted: {error}') from error
+
+    def _plan(self, prefix: bytes) -> _Plan:
+        """compile the plan of decoding the records with the prefix"""
+        _, tag, version, count = _COMPILED_HEADER.unpack_from(prefix)
+        cls = self._classes.get(tag, None)
+        if cls is None:
+            raise WechatyPuppetOperationError(f'unknown type tag <{tag}>')
+        shape = bytes(prefix[_COMPILED_HEADER.size:])
+        # the old versions have fewer fields which are the prefix of the current fields
+        names = self._field_names[tag]
+        if len(shape) != count or count > len(names) or not set(shape) <= set(b'ifts?'):
+            raise WechatyPuppetOperationError(f'invalid shape of <{cls.__name__}>')
+
+        plan = _Plan(
+            cls=cls,
+            tag=tag,
+            version=version,
+            layout=_Layout(names[:count], shape, self._enums[tag]),
+            restore_dict=(version == self._versions[tag] and count == len(names)
+                          and not hasattr(cls, '__post_init__') and not hasattr(cls, '__slots__'))
+        )
+        self._plans[bytes(prefix)] = plan
+        return plan
+
+    def _decode_plain(self, data: bytes) -> Any:
+        """decode the record written value by value"""
+        magic, tag, version = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise WechatyPuppetOperationError('the data is not encoded by BinaryCodec')
+
+        if tag == _PLAIN_TAG:
+            value, offset = _read(data, _HEADER.size)
+        else:
+            if tag not in self._classes:
+                raise WechatyPuppetOperationError(f'unknown type tag <{tag}>')
+            count, offset = _read_uint(data, _HEADER.size)
+            values = []
+            for _ in range(count):
+                item, offset = _read(data, offset)
+                values.append(item)
+            # the old versions have fewer fields which are the prefix of the current fields
+            value = self._restore(tag, version, dict(zip(self._field_names[tag], values)))
+
+        if offset != len(data):
+            raise WechatyPuppetOperationError('the record has trailing bytes')
+        return value
+
+    def _restore(self, tag: int, version: int, payload: Dict[str, Any]) -> Any:
+        """upgrade the fields to the latest version and create the dataclass"""
+        cls = self._classes[tag]
+        while version < self._versions[tag]:
+            upgrader = self._upgraders.get((tag, version), None)
+            if not upgrader:
+                raise WechatyPuppetOperationError(f'can not upgrade <{cls.__name__}> from version <{version}>')
+            payload = upgrader(payload)
+            version += 1
+
+        for name, enum in self._enums[tag].items():
+            value = payload.get(name, None)
+            if value is not None and not isinstance(value, enum):
+                payload[name] = enum(value)
+        return cls(**payload)
+
+    def is_stale(self, data: bytes) -> bool:
+        _, tag, version = _HEADER.unpack_from(data)
+        return tag != _PLAIN_TAG and version < self._versions.get(tag, 0)
+
+
+def default_codec() -> BinaryCodec:
+    """the binary codec with the payloads of the official account"""
+    codec = BinaryCodec()
+    codec.register(OAMessagePayload, tag=1, version=1)
+    codec.register(OAContactPayload, tag=2, version=1)
+    codec.register(AccessTokenPayload, tag=3, version=1)
+    return codec
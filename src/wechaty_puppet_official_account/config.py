@@ -6,5 +6,6 @@ app_id = os.environ.get('WECHATY_PUPPET_OA_APP_ID', None)
 app_secret = os.environ.get('WECHATY_PUPPET_OA_APP_SECRET', None)
 token = os.environ.get('WECHATY_PUPPET_OA_TOKEN', None)
 port = os.environ.get('WECHATY_PUPPET_OA_PORT', None)
+redis_url = os.environ.get('WECHATY_PUPPET_OA_REDIS_URL', None)
 
 official_account_url = "https://api.weixin.qq.com/cgi-bin/"
@@ -21,13 +21,14 @@ from __future__ import annotations
 
 import os
 from typing import Any, Optional
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
-from diskcache import Cache
 from wechaty_puppet import (
     get_logger,
     WechatyPuppetOperationError
 )
+from .codec import Codec, default_codec
+from .store_backend import StoreBackend, StoreLock, DiskCacheBackend
 from .schema import (
     OAMessagePayload,
     OAContactPayload,
@@ -43,6 +44,9 @@ class DataStoreOption:
         'wechaty-puppet-official-account',
         'data_cache'
     )
+    codec: Codec = field(default_factory=default_codec)
+    # the local diskcache in cache_dir is used by default
+    backend: Optional[StoreBackend] = None
 
 
 logger = get_logger('DataStore')
@@ -58,22 +62,46 @@ class DataStore:
         if not option:
             option = DataStoreOption()
 
-        logger.info(f'init DataStore instance <{option}>')
+        logger.info('init DataStore instance <%s>', option)
         self.option: DataStoreOption = option
 
         if not os.path.exists(self.option.cache_dir):
             os.makedirs(self.option.cache_dir)
 
-    def get(self, key: str) -> Optional[Any]:
-        """get the key-value from the diskcache"""
-        with Cache(self.option.cache_dir) as warehouse:
-            data = warehouse.get(key, None)
-        return data
+        self.backend: StoreBackend = self.option.backend or DiskCacheBackend(self.option.cache_dir)
+
+    def sub_dir(self, name: str) -> str:
+        """get the directory of a sub-store which lives under the cache_dir"""
+        path = os.path.join(self.option.cache_dir, name)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        return path
 
-    def set(self, key: str, value: Any):
-        """set the object by key to the disk cache"""
-        with Cache(self.option.cache_dir) as warehouse:
-            warehouse.set(key, value)
+    def get(self, key: str) -> Optional[Any]:
+        """get the value by key from the store backend, eg: the local diskcache or redis"""
+        codec = self.option.codec
+        data = self.backend.get(key)
+        if data is None:
+            return None
+
+        if not isinstance(data, bytes):
+            # the value is pickled by diskcache before the codec is introduced
+            self.backend.set(key, codec.encode(data))
+            return data
+
+        value = codec.decode(data)
+        if codec.is_stale(data):
+            # upgrade the stored value lazily
+            self.backend.set(key, codec.encode(value))
+        return value
+
+    def set(self, key: str, value: Any, expire: Optional[float] = None):
+        """set the object by key to the store, which expires after `expire` seconds"""
+        self.backend.set(key, self.option.codec.encode(value), expire=expire)
+
+    def lock(self, name: str, timeout: float = 30, blocking_timeout: float = 30) -> StoreLock:
+        """get the lock which is shared by the instances using the same store"""
+        return self.backend.lock(name, timeout=timeout, blocking_timeout=blocking_timeout)
 
     def get_message_payload(self, message_id: str) -> OAMessagePayload:
         """
@@ -86,11 +114,11 @@ class DataStore:
             raise WechatyPuppetOperationError(f'payload<{payload}> type is not OAMessagePayload')
         return payload
 
-    def set_message_payload(self, message_id: str, payload: OAMessagePayload):
+    def set_message_payload(self, message_id: str, payload: OAMessagePayload, expire: Optional[float] = None):
         """
-        set the message payload
+        set the message payload, which expires after `expire` seconds
         """
-        self.set(f'message-{message_id}', payload)
+        self.set(f'message-{message_id}', payload, expire=expire)
 
     def get_contact_payload(self, contact_id: str) -> OAContactPayload:
         """
@@ -114,7 +142,7 @@ class DataStore:
         """
         set the access_token payload
         """
-        self.set('access_token', payload)
+        self.set('access_token', payload, expire=payload.expires_in)
 
     def get_access_token_payload(self) -> Optional[AccessTokenPayload]:
         """
@@ -0,0 +1,272 @@
+"""
+Python Wechaty - https://github.com/wechaty/python-wechaty
+
+Authors:    Jingjing WU (吴京京) <https://github.com/wj-Mcat>
+
+2020-now @ Copyright Wechaty
+
+Licensed under the Apache License, Version 2.0 (the 'License');
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an 'AS IS' BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from __future__ import annotations
+
+import json
+import os
+import time
+from bisect import bisect_left, insort
+from dataclasses import dataclass, asdict
+from typing import IO, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from wechaty_puppet import get_logger, WechatyPuppetOperationError
+
+from .schema import OAMessagePayload
+
+logger = get_logger('MessageLog')
+
+
+@dataclass
+class MessageLogOption:
+    # the active segment is rotated when it is larger than segment_bytes
+    segment_bytes: int = 8 * 1024 * 1024
+    # the oldest segments are dropped when the log is larger than max_bytes
+    max_bytes: int = 512 * 1024 * 1024
+    # the segments whose messages are all older than max_age seconds are dropped
+    max_age: int = 30 * 24 * 3600
+
+
+class _Location(NamedTuple):
+    segment: int
+    offset: int
+    create_time: int
+    from_user: str
+    msg_type: str
+
+
+class MessageLog:
+    """
+    append-only message log with secondary indexes
+
+    the payloads are appended as json lines to segment files, and the indexes
+    on FromUserName, MsgType and CreateTime are kept in memory and rebuilt from
+    the segments at startup. Retention drops whole segments.
+
+    the log is local to the host, the instances sharing the store only share
+    the payloads by message id, see OfficialAccount.message_payload.
+    """
+
+    def __init__(self, directory: str, option: Optional[MessageLogOption] = None):
+        if not option:
+            option = MessageLogOption()
+        self.option: MessageLogOption = option
+        self.directory: str = directory
+
+        self._locations: Dict[str, _Location] = {}
+        self._by_from: Dict[str, List[str]] = {}
+        self._by_type: Dict[str, List[str]] = {}
+        self._by_time: List[Tuple[int, str]] = []
+
+        # segment -> (size in bytes, newest CreateTime)
+        self._segments: Dict[int, Tuple[int, int]] = {}
+        self._active: int = 0
+        self._writer: Optional[IO[bytes]] = None
+
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def __contains__(self, message_id: str) -> bool:
+        return message_id in self._locations
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f'{segment:08d}.log')
+
+    def _load(self):
+        """scan the segments and build the indexes"""
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        segments = sorted(
+            int(name[:-4]) for name in os.listdir(self.directory) if name.endswith('.log')
+        )
+        for segment in segments:
+            newest, offset = 0, 0
+            with open(self._segment_path(segment), 'rb') as reader:
+                for line in reader:
+                    try:
+                        payload = OAMessagePayload(**json.loads(line))
+                    except (ValueError, TypeError):
+                        # the last line may be truncated by a crash
+                        logger.warning('_load() skip broken record in segment <%d> at <%d>', segment, offset)
+                    else:
+                        self._index(payload, segment, offset)
+                        self._by_time.append((int(payload.CreateTime), payload.MsgId))
+                        newest = max(newest, int(payload.CreateTime))
+                    offset += len(line)
+            self._segments[segment] = (offset, newest)
+
+        self._active = segments[-1] if segments else 0
+        self._by_time.sort()
+        logger.info('_load() load <%d> messages from <%d> segments', len(self._locations), len(segments))
+
+    def _index(self, payload: OAMessagePayload, segment: int, offset: int):
+        """add the payload to the indexes except the sorted time index"""
+        create_time = int(payload.CreateTime)
+        self._locations[payload.MsgId] = _Location(
+            segment, offset, create_time, payload.FromUserName, payload.MsgType)
+        self._by_from.setdefault(payload.FromUserName, []).append(payload.MsgId)
+        self._by_type.setdefault(payload.MsgType, []).append(payload.MsgId)
+
+    def _open_writer(self) -> IO[bytes]:
+        if self._writer:
+            return self._writer
+
+        path = self._segment_path(self._active)
+        terminated = True
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as reader:
+                reader.seek(-1, os.SEEK_END)
+                terminated = reader.read(1) == b'\n'
+
+        self._writer = open(path, 'ab')
+        if not terminated:
+            # terminate the truncated record, so that the next record starts at a new line
+            self._writer.write(b'\n')
+            self._writer.flush()
+
+        _, newest = self._segments.get(self._active, (0, 0))
+        self._segments[self._active] = (self._writer.tell(), newest)
+        return self._writer
+
+    def append(self, payload: OAMessagePayload) -> bool:
+        """append the message to the log, returns False if it is a duplicated message"""
+        if payload.MsgId in self._locations:
+            return False
+
+        size, _ = self._segments.get(self._active, (0, 0))
+        if size >= self.option.segment_bytes:
+            self.close()
+            self._active += 1
+
+        writer = self._open_writer()
+        size, newest = self._segments[self._active]
+        record = json.dumps(asdict(payload), ensure_ascii=False).encode('utf-8') + b'\n'
+        writer.write(record)
+        writer.flush()
+
+        create_time = int(payload.CreateTime)
+        self._segments[self._active] = (size + len(record), max(newest, create_time))
+
+        self._index(payload, self._active, size)
+        # the messages arrive in time order mostly, so avoid insort for them
+        entry = (create_time, payload.MsgId)
+        if self._by_time and self._by_time[-1] > entry:
+            insort(self._by_time, entry)
+        else:
+            self._by_time.append(entry)
+        return True
+
+    def get(self, message_id: str) -> OAMessagePayload:
+        """read the message payload from the log"""
+        location = self._locations.get(message_id, None)
+        if not location:
+            raise WechatyPuppetOperationError(f'message payload<{message_id}> not found')
+
+        with open(self._segment_path(location.segment), 'rb') as reader:
+            reader.seek(location.offset)
+            return OAMessagePayload(**json.loads(reader.readline()))
+
+    def search(self, from_user: Optional[str] = None,
+               msg_type: Union[str, Iterable[str], None] = None,
+               since: Optional[int] = None, until: Optional[int] = None) -> List[str]:
+        """
+        find the message ids by the indexes, the ids are sorted by CreateTime
+
+        msg_type is one MsgType or the collection of them, eg: video & shortvideo,
+        since & until are the inclusive range of CreateTime
+        """
+        candidates: Optional[List[str]] = None
+        if from_user is not None:
+            candidates = self._by_from.get(from_user, [])
+
+        msg_types: Optional[FrozenSet[str]] = None
+        if msg_type is not None:
+            msg_types = frozenset([msg_type] if isinstance(msg_type, str) else msg_type)
+            by_types = [self._by_type.get(name, []) for name in msg_types]
+            if candidates is None or sum(map(len, by_types)) < len(candidates):
+                candidates = by_types[0] if len(by_types) == 1 else [
+                    message_id for by_type in by_types for message_id in by_type]
+
+        if candidates is None:
+            # only the time range is given, resolve it by the sorted time index
+            low = 0 if since is None else bisect_left(self._by_time, (since, ''))
+            high = len(self._by_time) if until is None else bisect_left(self._by_time, (until + 1, ''))
+            return [message_id for _, message_id in self._by_time[low:high]]
+
+        locations = self._locations
+        result = []
+        for message_id in candidates:
+            location = locations[message_id]
+            if from_user is not None and location.from_user != from_user:
+                continue
+            if msg_types is not None and location.msg_type not in msg_types:
+                continue
+            if since is not None and location.create_time < since:
+                continue
+            if until is not None and location.create_time > until:
+                continue
+            result.append(message_id)
+        result.sort(key=lambda message_id: locations[message_id].create_time)
+        return result
+
+    def compact(self, now: Optional[float] = None) -> int:
+        """drop the segments out of the retention, returns the number of dropped messages"""
+        if now is None:
+            now = time.time()
+        deadline = now - self.option.max_age
+        total = sum(size for size, _ in self._segments.values())
+
+        dropped = set()
+        for segment in sorted(self._segments):
+            if segment == self._active:
+                break
+            size, newest = self._segments[segment]
+            if newest >= deadline and total <= self.option.max_bytes:
+                break
+            os.remove(self._segment_path(segment))
+            del self._segments[segment]
+            dropped.add(segment)
+            total -= size
+
+        if not dropped:
+            return 0
+
+        count = len(self._locations)
+        self._locations = {
+            message_id: location for message_id, location in self._locations.items()
+            if location.segment not in dropped
+        }
+        self._by_from = {}
+        self._by_type = {}
+        for message_id, location in self._locations.items():
+            self._by_from.setdefault(location.from_user, []).append(message_id)
+            self._by_type.setdefault(location.msg_type, []).append(message_id)
+        self._by_time = [entry for entry in self._by_time if entry[1] in self._locations]
+
+        logger.info('compact() drop <%d> segments', len(dropped))
+        return count - len(self._locations)
+
+    def close(self):
+        """close the active segment"""
+        if self._writer:
+            self._writer.close()
+            self._writer = None
@@ -20,22 +20,45 @@ limitations under the License.
 from __future__ import annotations
 
 import asyncio
-from dataclasses import dataclass
+import json
+import os
+from dataclasses import dataclass, field, asdict
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, cast
 
+import aiohttp
 import requests
+from diskcache import Cache
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
-from wechaty_puppet import get_logger, WechatyPuppetError
+from wechaty_puppet import get_logger, WechatyPuppetError, WechatyPuppetOperationError
 
 from wechaty_puppet_official_account.webhook import Webhook, WebhookOptions
-from .data_store import DataStore
-from .schema import OAMessagePayload, AccessTokenPayload
+from .data_store import DataStore, DataStoreOption
+from .store_backend import RedisBackend, StoreBackend
+from .schema import OAMessagePayload, OAEventPayload, AccessTokenPayload
+from .send_queue import OutboundQueue, OutboundQueueOption, OutboundMessage, TOKEN_ERRCODES
+from .service_window import ServiceWindow, OUT_OF_WINDOW_ERRCODE, WINDOW_EVENTS
+from .template import MessageTemplate, TemplateSendResult
+from .message_log import MessageLog
+from .qr_code import QRCodeService
+from .circuit_breaker import CircuitBreakers, CircuitBreakerOption
 
 logger = get_logger('OfficialAccount')
 
+# seconds to keep the template msgid for correlating TEMPLATESENDJOBFINISH events
+TEMPLATE_JOB_TTL = 7 * 24 * 3600
+
+# the access token is refreshed when it expires in ACCESS_TOKEN_REFRESH_MARGIN seconds,
+# which is larger than the interval of the refreshing job
+ACCESS_TOKEN_REFRESH_MARGIN = 600
+# the max seconds between retries of refreshing the access token in background
+ACCESS_TOKEN_RETRY_MAX_DELAY = 60
+# the lock of refreshing the access token is held for at most the connect & read
+# timeouts of fetching it, the others wait for the lock at most as long
+ACCESS_TOKEN_LOCK_TIMEOUT_RATIO = 3
+
 
 @dataclass
 class OfficialAccountOption:
@@ -43,6 +66,16 @@ class OfficialAccountOption:
     app_secret: str
     port: int
     token: str
+    # share the access token, service windows & message payloads between instances,
+    # eg: redis://localhost:6379/0
+    redis_url: Optional[str] = None
+    # the shared store which is used instead of redis_url, eg: redis with the custom client
+    store_backend: Optional[StoreBackend] = None
+    # the directory of the local data, defaults to .wechaty under the working directory
+    cache_dir: Optional[str] = None
+    server_base_url: str = 'https://api.weixin.qq.com/cgi-bin/'
+    circuit_breaker: CircuitBreakerOption = field(default_factory=CircuitBreakerOption)
+    outbound_queue: OutboundQueueOption = field(default_factory=OutboundQueueOption)
 
 
 class OfficialAccount:
@@ -55,30 +88,87 @@ class OfficialAccount:
             )
         )
         self.options = options
-        self._data_store = DataStore()
-        self._server_base_url: str = 'https://api.weixin.qq.com/cgi-bin/'
+        data_store_option = DataStoreOption()
+        if options.cache_dir:
+            data_store_option.cache_dir = options.cache_dir
+        if options.store_backend:
+            data_store_option.backend = options.store_backend
+        elif options.redis_url:
+            data_store_option.backend = RedisBackend.from_url(options.redis_url)
+        self._data_store = DataStore(data_store_option)
+        # the local message log is always kept, the payloads are copied into the shared store only
+        self._share_payloads: bool = data_store_option.backend is not None
+        # the access token is cached in memory until it is going to be refreshed
+        self._access_token_payload: Optional[AccessTokenPayload] = None
+        self._server_base_url: str = options.server_base_url
 
         self._scheduler: AsyncIOScheduler = AsyncIOScheduler()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.breakers: CircuitBreakers = CircuitBreakers(options.circuit_breaker)
+        self._token_retry_task: Optional[asyncio.Task] = None
+        # only one executor thread refreshes the access token at a time
+        self._token_refreshing: Optional[asyncio.Lock] = None
+
+        self.outbound: OutboundQueue = OutboundQueue(
+            directory=self._data_store.sub_dir('outbound'),
+            sender=self._send_outbound,
+            option=options.outbound_queue,
+            breaker=self.breakers.get('message')
+        )
+        self.service_window: ServiceWindow = ServiceWindow(self._data_store)
+        self.service_window.migrate(os.path.join(self._data_store.option.cache_dir, 'service_window'))
+        self.message_log: MessageLog = MessageLog(
+            directory=self._data_store.sub_dir('message_log')
+        )
+        self.qr_code: QRCodeService = QRCodeService(
+            directory=self._data_store.sub_dir('qr_code'),
+            creator=lambda body: self._post_json('qrcode/create', body)
+        )
+        self._templates: Dict[str, MessageTemplate] = {}
+        self._template_jobs: Cache = Cache(self._data_store.sub_dir('template_jobs'))
 
     @property
     def access_token(self) -> str:
         """
         get the access token
+
+        the token is read from the store only when the one in memory is going to
+        be refreshed, so the api calls do not wait for the shared store.
         """
-        payload: AccessTokenPayload = self._data_store.get_access_token_payload()
+        payload = self._access_token_payload
+        if payload is None or self._expires_in(payload) <= ACCESS_TOKEN_REFRESH_MARGIN:
+            payload = self._data_store.get_access_token_payload()
+            if not payload:
+                raise WechatyPuppetError('access token not found, please start the official account first')
+            self._access_token_payload = payload
         return payload.token
 
+    def message_payload(self, message_id: str) -> OAMessagePayload:
+        """
+        get the message payload received by this instance, or by the others sharing the store
+        """
+        if message_id not in self.message_log and self._share_payloads:
+            return self._data_store.get_message_payload(message_id)
+        return self.message_log.get(message_id)
+
     async def start(self):
         """start the official account"""
 
         # 1. listen the event from webhook & start the webhook server
         async def on_message(payload: OAMessagePayload):
-            self._data_store.set_message_payload(
-                message_id=payload.MsgId,
-                payload=payload
-            )
+            self.service_window.touch(payload.FromUserName, int(payload.CreateTime))
+            self.message_log.append(payload)
+            if self._share_payloads:
+                self._data_store.set_message_payload(payload.MsgId, payload, expire=self.message_log.option.max_age)
+
+        async def on_event(payload: OAEventPayload):
+            # the user interactions, eg: clicking the menu, also open the window
+            if payload.Event.upper() in WINDOW_EVENTS:
+                self.service_window.touch(payload.FromUserName, int(payload.CreateTime))
+            self.qr_code.attribute(payload)
 
         self.webhook.on('message', on_message)
+        self.webhook.on('event', on_event)
         await self.webhook.start()
 
         # 2. start to fetch access token
@@ -90,8 +180,19 @@ class OfficialAccount:
             self._update_access_token,
             trigger=IntervalTrigger(seconds=300)
         )
+        self._scheduler.add_job(
+            self.service_window.evict,
+            trigger=IntervalTrigger(seconds=3600)
+        )
+        self._scheduler.add_job(
+            self.message_log.compact,
+            trigger=IntervalTrigger(seconds=3600)
+        )
         self._scheduler.start()
 
+        # 3. deliver the messages which were queued before restarting
+        await self.outbound.start()
+
     async def stop(self):
         """stop the official account"""
         logger.info('stop() stopping the official account.')
@@ -99,44 +200,271 @@ class OfficialAccount:
         # 1. stop the webhook
         await self.webhook.stop()
 
+        # 2. stop delivering, the pending messages are kept on disk
+        await self.outbound.stop()
+        if self._token_retry_task:
+            self._token_retry_task.cancel()
+        self.message_log.close()
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    async def _post(self, path: str, body: bytes) -> dict:
+        """
+        post the serialized json body to the official account api
+
+        the requests of the same api family share the circuit breaker, which
+        fails fast with CircuitOpenError when the api keeps failing.
+        """
+        if not self._session:
+            self._session = aiohttp.ClientSession()
+        session = self._session
+        params = {'access_token': self.access_token}
+
+        async def request() -> dict:
+            try:
+                async with session.post(f'{self._server_base_url}{path}', params=params, data=body) as res:
+                    if res.status != 200:
+                        raise WechatyPuppetError(f'request <{path}> failed with status <{res.status}>')
+                    return await res.json(content_type=None)
+            except aiohttp.ClientError as error:
+                raise WechatyPuppetError(f'request <{path}> failed: {error}') from error
+
+        # system busy tells that the api is unhealthy as well
+        return await self.breakers.for_path(path).call(
+            request, is_failure=lambda response: response.get('errcode', 0) == -1)
+
+    async def _post_json(self, path: str, data: Dict[str, Any]) -> dict:
+        """post the json data to the official account api"""
+        return await self._post(path, json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+    async def send_custom_message(self, openid: str, msgtype: str, content: Dict[str, Any]) -> dict:
+        """
+        send the customer service message
+
+        https://developers.weixin.qq.com/doc/offiaccount/Message_Management/Service_Center_messages.html
+        """
+        return await self._post_json('message/custom/send', {
+            'touser': openid,
+            'msgtype': msgtype,
+            msgtype: content
+        })
+
+    async def _send_outbound(self, message: OutboundMessage) -> dict:
+        """the sender of the outbound queue"""
+        # the window may be closed while the message is waiting for retrying
+        if not self.service_window.is_open(message.openid):
+            return {'errcode': OUT_OF_WINDOW_ERRCODE, 'errmsg': 'out of the customer service window'}
+
+        token = self.access_token
+        response = await self.send_custom_message(message.openid, message.msgtype, message.content)
+        if response.get('errcode', 0) in TOKEN_ERRCODES:
+            await self._update_access_token(stale_token=token)
+        return response
+
+    async def message_send_text(self, openid: str, text: str,
+                                idempotency_key: Optional[str] = None) -> str:
+        """
+        queue the text message, returns the id of the outbound message
+
+        CircuitOpenError is raised while the message api keeps failing
+        """
+        if not self.service_window.is_open(openid):
+            raise WechatyPuppetOperationError(
+                f'can not send message to <{openid}> out of the customer service window')
+        return self.outbound.put(openid, 'text', {'content': text}, idempotency_key)
+
+    def register_template(self, name: str, template_id: str, fields: Sequence[str],
+                          url: Optional[str] = None,
+                          mini_program: Optional[Dict[str, str]] = None,
+                          colors: Optional[Dict[str, str]] = None) -> MessageTemplate:
+        """validate and compile the template message, then register it with name"""
+        template = MessageTemplate(
+            template_id=template_id,
+            fields=fields,
+            url=url,
+            mini_program=mini_program,
+            colors=colors
+        )
+        self._templates[name] = template
+        return template
+
+    def _get_template(self, name: str) -> MessageTemplate:
+        template = self._templates.get(name, None)
+        if not template:
+            raise WechatyPuppetOperationError(f'template<{name}> is not registered')
+        return template
+
+    async def _send_template(self, template: MessageTemplate, openid: str,
+                             values: Dict[str, str]) -> TemplateSendResult:
+        """send the template message and record the msgid"""
+        body = template.render(openid, values)
+        try:
+            response = await self._post('message/template/send', body)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exception:  # pylint: disable=broad-except
+            return TemplateSendResult(openid=openid, msgid=None, errcode=-1, errmsg=str(exception))
+
+        if self._is_error(response):
+            return TemplateSendResult(openid=openid, msgid=None,
+                                      errcode=response['errcode'], errmsg=response.get('errmsg', ''))
+
+        result = TemplateSendResult(openid=openid, msgid=response['msgid'])
+        self._template_jobs.set(result.msgid, asdict(result), expire=TEMPLATE_JOB_TTL)
+        return result
+
+    async def send_template(self, name: str, openid: str, values: Dict[str, str]) -> TemplateSendResult:
+        """send the registered template message to the user"""
+        return await self._send_template(self._get_template(name), openid, values)
+
+    async def send_template_batch(self, name: str, recipients: Iterable[Tuple[str, Dict[str, str]]],
+                                  concurrency: int = 16) -> List[TemplateSendResult]:
+        """
+        send the registered template message to the recipients
+
+        at most `concurrency` requests are in flight, and the results are in
+        the same order as the recipients.
+        """
+        template = self._get_template(name)
+        results: List[Optional[TemplateSendResult]] = []
+        jobs = iter(recipients)
+
+        async def worker():
+            for openid, values in jobs:
+                index = len(results)
+                results.append(None)
+                try:
+                    results[index] = await self._send_template(template, openid, values)
+                except WechatyPuppetOperationError as error:
+                    results[index] = TemplateSendResult(openid=openid, msgid=None, errcode=-1, errmsg=str(error))
+
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        logger.info('send_template_batch() send <%d> template<%s> messages', len(results), name)
+        # every position is filled by the workers
+        return cast(List[TemplateSendResult], results)
+
+    def template_send_result(self, msgid: int) -> Optional[TemplateSendResult]:
+        """find the sent template message by msgid, eg: from TEMPLATESENDJOBFINISH event"""
+        data = self._template_jobs.get(int(msgid), None)
+        if data is None:
+            return None
+        return TemplateSendResult(**data)
+
     @staticmethod
     def _is_error(response: dict) -> bool:
         """check if the result is error"""
         return 'errcode' in response and response['errcode'] != 0
 
-    async def _update_access_token(self):
-        """update the access token data"""
-        logger.info('_update_access_token()')
+    async def _update_access_token(self, stale_token: Optional[str] = None):
+        """
+        update the access token data
 
-        # 1. check if the disk has cached access token
-        access_token_payload = self._data_store.get_access_token_payload()
+        the token is also refreshed when it equals to stale_token, eg: the api
+        tells that the token is invalid.
+        """
+        logger.info('_update_access_token()')
+        try:
+            await self._refresh_in_executor(stale_token)
+        except WechatyPuppetError as error:
+            # keep serving the cached token if it is still valid
+            payload = self._data_store.get_access_token_payload()
+            if not payload or payload.token == stale_token or self._expires_in(payload) <= 0:
+                raise
+            logger.warning('_update_access_token() failed, keep using the token which expires in %.0fs: %s',
+                           self._expires_in(payload), error)
+            self._retry_access_token(stale_token)
+
+    def _retry_access_token(self, stale_token: Optional[str]):
+        """retry refreshing the access token in background"""
+        if self._token_retry_task and not self._token_retry_task.done():
+            return
+
+        async def retry():
+            delay = 1.0
+            while True:
+                await asyncio.sleep(delay)
+                try:
+                    await self._refresh_in_executor(stale_token)
+                    logger.info('_retry_access_token() the access token is refreshed')
+                    return
+                except WechatyPuppetError as error:
+                    delay = min(delay * 2, ACCESS_TOKEN_RETRY_MAX_DELAY)
+                    logger.warning('_retry_access_token() retry in %.0fs: %s', delay, error)
+
+        self._token_retry_task = asyncio.ensure_future(retry())
+
+    async def _refresh_in_executor(self, stale_token: Optional[str]):
+        """
+        refresh the access token in the executor one at a time
 
-        if access_token_payload:
-            # check the expire time of the access_token
-            now = datetime.now()
-            if access_token_payload.refresh_time + timedelta(seconds=access_token_payload.expires_in) > now:
-                logger.debug(f'the access_token_payload<{access_token_payload}> is in expire time')
-                return
+        the blocking call is not wrapped by wait_for, which can not stop the
+        thread, it is bounded by the timeouts of the lock & the http request.
+        """
+        if self._token_refreshing is None:
+            self._token_refreshing = asyncio.Lock()
+        async with self._token_refreshing:
+            loop = asyncio.get_event_loop()
+            try:
+                await loop.run_in_executor(None, self._refresh_access_token, stale_token)
+            finally:
+                # read the token refreshed by this or the other instances
+                self._access_token_payload = None
 
-        res = requests.get(
-            f'{self._server_base_url}token?grant_type=client_credential&'
-            f'appid=${self.options.app_id}&secret=${self.options.app_secret}'
-        )
+    @staticmethod
+    def _expires_in(payload: AccessTokenPayload) -> float:
+        """seconds until the access token expires"""
+        expire_time = payload.refresh_time + timedelta(seconds=payload.expires_in)
+        return (expire_time - datetime.now()).total_seconds()
+
+    def _refresh_access_token(self, stale_token: Optional[str]):
+        """refresh the access token in the lock shared by the instances"""
+        # every refresh invalidates the previous token, so the instances
+        # sharing the store must not refresh it at the same time
+        lock_timeout = self.options.circuit_breaker.timeout * ACCESS_TOKEN_LOCK_TIMEOUT_RATIO
+        with self._data_store.lock('access_token', timeout=lock_timeout, blocking_timeout=lock_timeout):
+            # 1. check if the store has cached access token, which may be refreshed by others
+            access_token_payload = self._data_store.get_access_token_payload()
+
+            if access_token_payload and access_token_payload.token != stale_token:
+                # check the expire time of the access_token, refresh it before expired
+                if self._expires_in(access_token_payload) > ACCESS_TOKEN_REFRESH_MARGIN:
+                    logger.debug('the access_token refreshed at <%s> is in expire time', access_token_payload.refresh_time)
+                    return
+
+            # only the http request is guarded, waiting for the lock is not the failure of the api
+            breaker = self.breakers.get('token')
+            breaker.before_call()
+            try:
+                self._fetch_access_token()
+            except Exception:
+                breaker.record_failure()
+                raise
+            breaker.record_success()
+
+    def _fetch_access_token(self):
+        """fetch the access token from the official account api"""
+        try:
+            res = requests.get(
+                f'{self._server_base_url}token?grant_type=client_credential&'
+                f'appid={self.options.app_id}&secret={self.options.app_secret}',
+                timeout=self.options.circuit_breaker.timeout
+            )
+        except requests.RequestException as error:
+            raise WechatyPuppetError(f'can not get access token: {error}') from error
 
         if res.status_code != 200:
             raise WechatyPuppetError('can not get access token')
         response_data = res.json()
 
-        logger.debug(f'_update_access_token() receive data <{response_data}>')
-
         if self._is_error(response_data):
             raise WechatyPuppetError(f'can not get access token with msg <{response_data["errmsg"]}>')
 
         access_token_payload = AccessTokenPayload(
             expires_in=response_data['expires_in'],
             refresh_time=datetime.now(),
-            token=response_data['token']
+            token=response_data['access_token']
         )
 
         self._data_store.set_access_token_payload(access_token_payload)
-        logger.debug(f'update_access_token() synced. New token will expiredIn {response_data["expires_in"]} seconds')
+        logger.debug('update_access_token() synced. New token will expiredIn %s seconds', response_data['expires_in'])
@@ -20,7 +20,7 @@ limitations under the License.
 from __future__ import annotations
 
 import asyncio
-from typing import List, Optional
+from typing import Dict, List, Optional
 from dataclasses import dataclass
 from pyee import AsyncIOEventEmitter
 
@@ -73,12 +73,25 @@ from .schema import OAMessagePayload
 
 logger = get_logger('OfficialAccountPuppet')
 
+# MsgType of official account -> MessageType of wechaty
+MESSAGE_TYPE_MAP: Dict[str, MessageType] = {
+    'text': MessageType.MESSAGE_TYPE_TEXT,
+    'image': MessageType.MESSAGE_TYPE_IMAGE,
+    'voice': MessageType.MESSAGE_TYPE_AUDIO,
+    'video': MessageType.MESSAGE_TYPE_VIDEO,
+    'shortvideo': MessageType.MESSAGE_TYPE_VIDEO,
+    'location': MessageType.MESSAGE_TYPE_LOCATION,
+    'link': MessageType.MESSAGE_TYPE_URL,
+}
+
 
 @dataclass
 class OfficialAccountPuppetOptions(PuppetOptions):
     app_id: Optional[str] = None
     app_secret: Optional[str] = None
     port: Optional[int] = 80
+    redis_url: Optional[str] = None
+    cache_dir: Optional[str] = None
 
 
 class OfficialAccountPuppet(Puppet):
@@ -89,7 +102,8 @@ class OfficialAccountPuppet(Puppet):
                 app_id=config.app_id,
                 app_secret=config.app_secret,
                 token=config.token,
-                port=config.port
+                port=config.port,
+                redis_url=config.redis_url
             )
         if not options.app_id:
             raise WechatyPuppetConfigurationError('WECHATY_PUPPET_OA_APP_ID environment variable not found')
@@ -105,7 +119,9 @@ class OfficialAccountPuppet(Puppet):
                 app_id=options.app_id,
                 app_secret=options.app_secret,
                 port=options.port,
-                token=options.token
+                token=options.token,
+                redis_url=options.redis_url,
+                cache_dir=options.cache_dir
             )
         )
         self._event_emitter: AsyncIOEventEmitter = AsyncIOEventEmitter()
@@ -166,7 +182,8 @@ class OfficialAccountPuppet(Puppet):
         pass
 
     async def message_send_text(self, conversation_id: str, message: str, mention_ids: List[str] = None) -> str:
-        pass
+        """send the text message to the user through the outbound queue"""
+        return await self.oa.message_send_text(conversation_id, message)
 
     async def message_send_contact(self, contact_id: str, conversation_id: str) -> str:
         pass
@@ -181,13 +198,65 @@ class OfficialAccountPuppet(Puppet):
         pass
 
     async def message_search(self, query: Optional[MessageQueryFilter] = None) -> List[str]:
-        pass
+        """
+        search the message ids from the message log
+
+        only the messages received by this instance are indexed, the message
+        received by the others sharing the store is found by id only.
+        """
+        message_log = self.oa.message_log
+        if not query:
+            query = MessageQueryFilter()
+
+        # there is no room in official account
+        if query.room_id:
+            return []
+        msg_types: Optional[List[str]] = None
+        if query.type:
+            msg_types = [msg_type for msg_type, message_type in MESSAGE_TYPE_MAP.items()
+                         if message_type == query.type]
+
+        if query.id:
+            try:
+                payloads = {query.id: self.oa.message_payload(query.id)}
+            except WechatyPuppetOperationError:
+                return []
+            message_ids = [query.id]
+        else:
+            message_ids = message_log.search(from_user=query.from_id, msg_type=msg_types)
+            if query.text is None and query.to_id is None:
+                return message_ids
+            payloads = {}
+
+        # the fields without index, and all of the fields of the id hit, are filtered by the payloads
+        result = []
+        for message_id in message_ids:
+            payload = payloads.get(message_id, None) or message_log.get(message_id)
+            if query.from_id is not None and payload.FromUserName != query.from_id:
+                continue
+            if msg_types is not None and payload.MsgType not in msg_types:
+                continue
+            if query.to_id is not None and payload.ToUserName != query.to_id:
+                continue
+            if query.text is not None and query.text not in payload.Content:
+                continue
+            result.append(message_id)
+        return result
 
     async def message_recall(self, message_id: str) -> bool:
         pass
 
     async def message_payload(self, message_id: str) -> MessagePayload:
-        pass
+        """get the message payload from the message log, or from the store shared by the instances"""
+        payload = self.oa.message_payload(message_id)
+        return MessagePayload(
+            id=payload.MsgId,
+            text=payload.Content,
+            timestamp=int(payload.CreateTime),
+            type=MESSAGE_TYPE_MAP.get(payload.MsgType, MessageType.MESSAGE_TYPE_UNSPECIFIED),
+            from_id=payload.FromUserName,
+            to_id=payload.ToUserName
+        )
 
     async def message_forward(self, to_id: str, message_id: str):
         pass
@@ -252,7 +321,9 @@ class OfficialAccountPuppet(Puppet):
         pass
 
     async def contact_self_qr_code(self) -> str:
-        pass
+        """the permanent qr code of the official account"""
+        payload = await self.oa.qr_code.create('contact-self', expire_seconds=None)
+        return payload.url
 
     async def contact_self_name(self, name: str):
         pass
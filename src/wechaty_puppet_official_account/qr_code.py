@@ -0,0 +1,208 @@
+"""
+Python Wechaty - https://github.com/wechaty/python-wechaty
+
+Authors:    Jingjing WU (吴京京) <https://github.com/wj-Mcat>
+
+2020-now @ Copyright Wechaty
+
+Licensed under the Apache License, Version 2.0 (the 'License');
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an 'AS IS' BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import asdict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Union
+
+from diskcache import Cache
+from wechaty_puppet import get_logger, WechatyPuppetError, WechatyPuppetOperationError
+
+from .schema import OAEventPayload, QRCodePayload
+
+logger = get_logger('QRCodeService')
+
+Scene = Union[int, str]
+Creator = Callable[[Dict[str, Any]], Awaitable[dict]]
+
+# https://developers.weixin.qq.com/doc/offiaccount/Account_Management/Generating_a_Parametric_QR_Code.html
+MAX_EXPIRE_SECONDS = 30 * 24 * 3600
+MAX_PERMANENT_SCENE_ID = 100000
+MAX_SCENE_STR_LENGTH = 64
+
+# the ticket is reused in the first half of its life, so that the handed out
+# qr code is valid for at least half of the requested expire_seconds
+_REUSE_RATIO = 0.5
+
+# the EventKey of the subscribe event is prefixed with qrscene_
+_SUBSCRIBE_SCENE_PREFIX = 'qrscene_'
+
+# the event is pushed up to 3 times in 15 seconds when the reply is slow, and
+# the event without MsgId is deduplicated by FromUserName + CreateTime
+# https://developers.weixin.qq.com/doc/offiaccount/Message_Management/Receiving_event_pushes.html
+_EVENT_DEDUP_TTL = 60
+
+
+def _validate_scene(scene: Scene, permanent: bool):
+    if isinstance(scene, int):
+        if scene <= 0 or scene >= 2 ** 32:
+            raise WechatyPuppetOperationError(f'scene_id <{scene}> should be a positive 32-bit integer')
+        if permanent and scene > MAX_PERMANENT_SCENE_ID:
+            raise WechatyPuppetOperationError(
+                f'scene_id <{scene}> of permanent qr code should be in 1 ~ {MAX_PERMANENT_SCENE_ID}')
+    elif not 0 < len(scene) <= MAX_SCENE_STR_LENGTH:
+        raise WechatyPuppetOperationError(
+            f'scene_str <{scene}> length should be in 1 ~ {MAX_SCENE_STR_LENGTH}')
+
+
+class QRCodeService:
+    """
+    create the parametric qr codes with cache, and attribute the scans to scenes
+    """
+
+    def __init__(self, directory: str, creator: Creator, concurrency: int = 16):
+        self.concurrency: int = concurrency
+        self._creator: Creator = creator
+        self._cache: Cache = Cache(directory)
+        # the qr codes which are being created, so that the same scene is only created once
+        self._creating: Dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def _key(scene: Scene, expire_seconds: Optional[int]) -> str:
+        kind = 'id' if isinstance(scene, int) else 'str'
+        return f'qr:{kind}:{scene}:{expire_seconds or "permanent"}'
+
+    def cached(self, scene: Scene, expire_seconds: Optional[int] = MAX_EXPIRE_SECONDS) -> Optional[QRCodePayload]:
+        """get the cached qr code of the scene"""
+        data = self._cache.get(self._key(scene, expire_seconds), None)
+        if data is None:
+            return None
+        return QRCodePayload(**data)
+
+    async def create(self, scene: Scene, expire_seconds: Optional[int] = MAX_EXPIRE_SECONDS) -> QRCodePayload:
+        """
+        get or create the qr code of the scene, the qr code is permanent when
+        expire_seconds is None
+        """
+        permanent = expire_seconds is None
+        _validate_scene(scene, permanent)
+        if expire_seconds is not None and not 0 < expire_seconds <= MAX_EXPIRE_SECONDS:
+            raise WechatyPuppetOperationError(f'expire_seconds should be in 1 ~ {MAX_EXPIRE_SECONDS}')
+
+        key = self._key(scene, expire_seconds)
+        payload = self.cached(scene, expire_seconds)
+        if payload:
+            return payload
+
+        future = self._creating.get(key, None)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_event_loop().create_future()
+        self._creating[key] = future
+        try:
+            payload = await self._create(scene, expire_seconds)
+            cache_expire = None if permanent else (payload.expire_seconds or expire_seconds) * _REUSE_RATIO
+            self._cache.set(key, asdict(payload), expire=cache_expire)
+        except BaseException as exception:
+            future.set_exception(exception)
+            # the exception is raised to the caller, do not warn for the unretrieved future
+            future.exception()
+            raise
+        else:
+            future.set_result(payload)
+        finally:
+            del self._creating[key]
+        return payload
+
+    async def _create(self, scene: Scene, expire_seconds: Optional[int]) -> QRCodePayload:
+        scene_field = 'scene_id' if isinstance(scene, int) else 'scene_str'
+        action_name = 'QR_SCENE' if isinstance(scene, int) else 'QR_STR_SCENE'
+        body: Dict[str, Any] = {
+            'action_info': {'scene': {scene_field: scene}}
+        }
+        if expire_seconds is None:
+            body['action_name'] = action_name.replace('QR_', 'QR_LIMIT_')
+        else:
+            body['action_name'] = action_name
+            body['expire_seconds'] = expire_seconds
+
+        response = await self._creator(body)
+        if response.get('errcode', 0) != 0:
+            raise WechatyPuppetError(f'can not create qr code <{scene}> with msg <{response.get("errmsg")}>')
+
+        return QRCodePayload(
+            scene=str(scene),
+            ticket=response['ticket'],
+            url=response['url'],
+            expire_seconds=response.get('expire_seconds', None),
+            create_time=int(time.time())
+        )
+
+    async def create_batch(self, scenes: Iterable[Scene],
+                           expire_seconds: Optional[int] = MAX_EXPIRE_SECONDS,
+                           concurrency: Optional[int] = None) -> List[Optional[QRCodePayload]]:
+        """
+        create the qr codes of the scenes with bounded concurrency, the results
+        are in the same order as the scenes, and None for the failed ones
+        """
+        results: List[Optional[QRCodePayload]] = []
+        jobs = iter(scenes)
+
+        async def worker():
+            for scene in jobs:
+                index = len(results)
+                results.append(None)
+                try:
+                    results[index] = await self.create(scene, expire_seconds)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as error:  # pylint: disable=broad-except
+                    logger.warning('create_batch() can not create qr code <%s>: %s', scene, error)
+
+        await asyncio.gather(*[worker() for _ in range(concurrency or self.concurrency)])
+        return results
+
+    def attribute(self, payload: OAEventPayload) -> Optional[str]:
+        """
+        attribute the subscribe & SCAN event to the scene, returns the scene
+
+        the retried pushes of the same event are counted once
+        """
+        event = payload.Event.upper()
+        event_key = payload.EventKey or ''
+        if event == 'SUBSCRIBE' and event_key.startswith(_SUBSCRIBE_SCENE_PREFIX):
+            scene = event_key[len(_SUBSCRIBE_SCENE_PREFIX):]
+        elif event == 'SCAN' and event_key:
+            scene = event_key
+        else:
+            return None
+
+        event_id = f'event:{payload.FromUserName}:{payload.CreateTime}:{event}:{event_key}'
+        if not self._cache.add(event_id, True, expire=_EVENT_DEDUP_TTL):
+            logger.debug('attribute() ignore the retried event <%s>', event_id)
+            return scene
+
+        self._cache.incr(f'stats:{scene}:{event.lower()}')
+        self._cache.set(f'openid:{payload.FromUserName}', scene)
+        return scene
+
+    def scene_stats(self, scene: Scene) -> Dict[str, int]:
+        """get the number of the scans & subscribes of the scene"""
+        return {
+            event: self._cache.get(f'stats:{scene}:{event}', 0)
+            for event in ['scan', 'subscribe']
+        }
+
+    def scene_of(self, openid: str) -> Optional[str]:
+        """get the scene which the user scanned at last"""
+        return self._cache.get(f'openid:{openid}', None)
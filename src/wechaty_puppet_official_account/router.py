@@ -0,0 +1,383 @@
+"""
+Python Wechaty - https://github.com/wechaty/python-wechaty
+
+Authors:    Jingjing WU (吴京京) <https://github.com/wj-Mcat>
+
+2020-now @ Copyright Wechaty
+
+Licensed under the Apache License, Version 2.0 (the 'License');
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an 'AS IS' BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from __future__ import annotations
+
+import re
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Pattern, Set, Tuple, Union
+
+from wechaty_puppet import WechatyPuppetOperationError
+
+from .schema import OAEventPayload, OAMessagePayload
+
+Payload = Union[OAMessagePayload, OAEventPayload]
+
+# the handler may return the text which is replied to the user passively
+Handler = Callable[[Payload], Awaitable[Optional[str]]]
+
+_REGEX_SPECIAL_CHARS = frozenset('.^$*+?{}[]\\|()')
+_QUANTIFIERS = frozenset('*?{')
+
+
+def literal_prefix(pattern: str) -> str:
+    """get the literal text which must be at the beginning of the matched text"""
+    if '|' in pattern:
+        return ''
+    index = 0
+    while index < len(pattern) and pattern[index] not in _REGEX_SPECIAL_CHARS:
+        index += 1
+    # the last char is optional when it is followed by a quantifier, eg: 'ab?'
+    if index < len(pattern) and pattern[index] in _QUANTIFIERS:
+        index -= 1
+    return pattern[:max(index, 0)]
+
+
+def _skip_token(pattern: str, index: int) -> int:
+    """get the end of the non-literal token at index, eg: a class, a group or an escape"""
+    char = pattern[index]
+    if char == '\\':
+        return index + 2
+    if char == '{':
+        end = pattern.find('}', index)
+        return end + 1 if end >= 0 else len(pattern)
+    if char not in '([':
+        return index + 1
+
+    depth = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if char == '\\':
+            index += 2
+            continue
+        if char == '[':
+            # the first ] of the class is literal, eg: []a] or [^]a]
+            index += 2 if pattern.startswith('[^', index) else 1
+            index += 1 if pattern.startswith(']', index) else 0
+            while index < len(pattern) and pattern[index] != ']':
+                index += 2 if pattern[index] == '\\' else 1
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        index += 1
+        if depth == 0:
+            break
+    return index
+
+
+def required_literal(pattern: str) -> str:
+    """
+    get the longest literal text which must be in the matched text, eg: '-1-'
+    of '[a-z]+-1-\\d+', the groups and the classes are skipped
+    """
+    if re.compile(pattern).flags & (re.IGNORECASE | re.VERBOSE):
+        return ''
+
+    runs: List[str] = []
+    run: List[str] = []
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if char == '|':
+            # the alternation at the top level, nothing is required
+            return ''
+        literal: Optional[str] = None
+        if char == '\\' and index + 1 < len(pattern):
+            if not pattern[index + 1].isalnum():
+                literal = pattern[index + 1]
+            elif pattern[index + 1] not in 'dDsSwWbBAZ':
+                # the escapes of the chars, eg: \\n, \\x41, or the references
+                return ''
+            end = index + 2
+        elif char in _REGEX_SPECIAL_CHARS:
+            end = _skip_token(pattern, index)
+        else:
+            literal, end = char, index + 1
+
+        if literal is not None and (end >= len(pattern) or pattern[end] not in _QUANTIFIERS):
+            run.append(literal)
+            # the repeated char is required, but the chars around it are not adjacent
+            if end < len(pattern) and pattern[end] == '+':
+                runs.append(''.join(run))
+                run = []
+        else:
+            runs.append(''.join(run))
+            run = []
+        index = end
+    runs.append(''.join(run))
+    return max(runs, key=len)
+
+
+_RULE_GROUP = '_rule'
+# the rules in one combined regex, the cost of matching grows faster than the
+# count of the named groups
+_CHUNK_SIZE = 32
+# the length of the literal text which the rules of the large buckets are indexed by
+_GRAM_SIZE = 4
+
+
+def _rule_group(index: int, pattern: str) -> str:
+    return f'(?P<{_RULE_GROUP}{index}>{pattern})'
+
+
+def has_numeric_reference(pattern: str) -> bool:
+    """
+    check if the pattern refers to the groups by number, eg: (a)\\1, (a)?(?(1)b|c),
+    which refer to the other groups after the pattern is combined
+    """
+    index = 0
+    while index < len(pattern) - 1:
+        char = pattern[index]
+        if char == '\\':
+            if pattern[index + 1] in '123456789':
+                return True
+            index += 2
+            continue
+        if pattern.startswith('(?(', index) and pattern[index + 3:index + 4].isdigit():
+            return True
+        index += 1
+    return False
+
+
+class _Chunk:
+    """the rules which are matched by one combined regex"""
+    __slots__ = ('indexes', 'regex', 'rule_regexes')
+
+    def __init__(self, indexes: List[int], regexes: List[Pattern]):
+        self.indexes: List[int] = indexes
+        self.regex: Optional[Pattern] = None
+        # the regexes which are matched one by one when they can not be
+        # combined, eg: they define the same group name
+        self.rule_regexes: Optional[List[Pattern]] = None
+
+        patterns = [regexes[index].pattern for index in indexes]
+        if not any(has_numeric_reference(pattern) for pattern in patterns):
+            try:
+                self.regex = re.compile('|'.join(
+                    _rule_group(position, pattern) for position, pattern in enumerate(patterns)
+                ))
+                return
+            except re.error:
+                pass
+        self.rule_regexes = [regexes[index] for index in indexes]
+
+    def match(self, text: str) -> Optional[int]:
+        """get the index of the first rule which matches the text"""
+        if self.regex is not None:
+            matched = self.regex.match(text)
+            if matched:
+                # the rule group closes after the groups inside it, so it is the lastgroup
+                return self.indexes[int(matched.lastgroup[len(_RULE_GROUP):])]
+            return None
+        for position, regex in enumerate(self.rule_regexes):
+            if regex.match(text):
+                return self.indexes[position]
+        return None
+
+
+class _RegexBucket:
+    """
+    the compiled regexes of the rules in one trie node
+
+    the rules of the large bucket are indexed by the grams of their required
+    literals, only the ones whose grams are in the text are matched. The
+    others are combined into the chunks of bounded size.
+    """
+    __slots__ = ('regexes', 'chunks', 'grams')
+
+    def __init__(self, patterns: List[str]):
+        self.regexes: List[Pattern] = [re.compile(pattern) for pattern in patterns]
+        self.grams: Dict[str, List[int]] = {}
+        unindexed: List[int] = []
+        for index, pattern in enumerate(patterns):
+            literal = required_literal(pattern) if len(patterns) > _CHUNK_SIZE else ''
+            if len(literal) < _GRAM_SIZE:
+                unindexed.append(index)
+                continue
+            # the least shared gram of the literal is the most selective one
+            gram = min(
+                (literal[start:start + _GRAM_SIZE] for start in range(len(literal) - _GRAM_SIZE + 1)),
+                key=lambda gram: len(self.grams.get(gram, ()))
+            )
+            self.grams.setdefault(gram, []).append(index)
+        self.chunks: List[_Chunk] = [
+            _Chunk(unindexed[start:start + _CHUNK_SIZE], self.regexes)
+            for start in range(0, len(unindexed), _CHUNK_SIZE)
+        ]
+
+    def match(self, text: str) -> Optional[int]:
+        """get the index of the first registered rule which matches the text"""
+        found: Optional[int] = None
+        for chunk in self.chunks:
+            found = chunk.match(text)
+            if found is not None:
+                break
+        if not self.grams:
+            return found
+
+        grams = self.grams
+        candidates = [
+            index
+            for start in range(len(text) - _GRAM_SIZE + 1)
+            for index in grams.get(text[start:start + _GRAM_SIZE], ())
+        ]
+        for index in sorted(candidates):
+            if found is not None and index > found:
+                break
+            if self.regexes[index].match(text):
+                return index
+        return found
+
+
+class _TrieNode:
+    __slots__ = ('children', 'prefix_handler', 'regex_rules', 'bucket')
+
+    def __init__(self):
+        self.children: Dict[str, _TrieNode] = {}
+        self.prefix_handler: Optional[Handler] = None
+        self.regex_rules: List[Tuple[str, Handler]] = []
+        # the compiled regex_rules, compiled lazily
+        self.bucket: Optional[_RegexBucket] = None
+
+
+class Router:
+    """
+    the routing table of the messages & events
+
+    text messages are matched in order of:
+        1. exact keyword, by dict
+        2. regex, matched from the beginning of the text like `re.match`.
+           The regexes are bucketed in the trie by their literal prefixes, the
+           one with longer literal prefix and registered earlier wins. The
+           regexes in the same bucket are combined into the regexes of at most
+           _CHUNK_SIZE rules, which fall back to matching the rules one by one
+           if they can not be combined, eg: they define the same group name or
+           refer to groups by number. The rules of the large bucket with the
+           required literals, eg: (?i:order)-1-\\d+, are prefiltered by the
+           literals in the text instead.
+        3. longest prefix, by trie
+        4. default handler
+    events are matched by (Event, EventKey), then by Event.
+    """
+
+    def __init__(self):
+        self._keywords: Dict[str, Handler] = {}
+        self._events: Dict[Tuple[str, Optional[str]], Handler] = {}
+        self._root: _TrieNode = _TrieNode()
+        self._default: Optional[Handler] = None
+        self._dirty_nodes: Set[_TrieNode] = set()
+
+    def _node(self, text: str) -> _TrieNode:
+        node = self._root
+        for char in text:
+            child = node.children.get(char, None)
+            if child is None:
+                child = node.children[char] = _TrieNode()
+            node = child
+        return node
+
+    def keyword(self, keyword: str, handler: Handler):
+        """route the text which equals to keyword"""
+        self._keywords[keyword] = handler
+
+    def prefix(self, prefix: str, handler: Handler):
+        """route the text which starts with prefix"""
+        self._node(prefix).prefix_handler = handler
+
+    def regex(self, pattern: str, handler: Handler):
+        """
+        route the text which matches the pattern from the beginning
+
+        prefer the scoped inline flags to the global ones, eg: (?i:abc), the
+        regex with global flags can not be combined with the others.
+        """
+        try:
+            re.compile(pattern)
+        except re.error as error:
+            raise WechatyPuppetOperationError(f'invalid regex <{pattern}>: {error}') from error
+
+        node = self._node(literal_prefix(pattern))
+        node.regex_rules.append((pattern, handler))
+        node.bucket = None
+        self._dirty_nodes.add(node)
+
+    def event(self, event: str, handler: Handler, key: Optional[str] = None):
+        """route the event, eg: CLICK, VIEW, scancode_push, with the optional EventKey"""
+        self._events[(event.upper(), key)] = handler
+
+    def default(self, handler: Handler):
+        """route the messages which match no rules"""
+        self._default = handler
+
+    def compile(self):
+        """combine the regexes of the changed buckets"""
+        for node in self._dirty_nodes:
+            node.bucket = _RegexBucket([pattern for pattern, _ in node.regex_rules])
+        self._dirty_nodes.clear()
+
+    def match(self, payload: Payload) -> Optional[Handler]:
+        """find the handler of the payload"""
+        if isinstance(payload, OAEventPayload):
+            event = payload.Event.upper()
+            handler = self._events.get((event, payload.EventKey), None)
+            if handler is None:
+                handler = self._events.get((event, None), None)
+            return handler or self._default
+
+        if payload.MsgType != 'text':
+            return self._default
+        return self.match_text(payload.Content)
+
+    def match_text(self, text: str) -> Optional[Handler]:
+        """find the handler of the text"""
+        handler = self._keywords.get(text, None)
+        if handler is not None:
+            return handler
+
+        if self._dirty_nodes:
+            self.compile()
+
+        # collect the trie nodes along the text, the deepest node is the last one
+        path = [self._root]
+        node = self._root
+        for char in text:
+            child = node.children.get(char, None)
+            if child is None:
+                break
+            node = child
+            path.append(node)
+
+        for node in reversed(path):
+            if node.bucket is not None:
+                index = node.bucket.match(text)
+                if index is not None:
+                    return node.regex_rules[index][1]
+
+        for node in reversed(path):
+            if node.prefix_handler is not None:
+                return node.prefix_handler
+
+        return self._default
+
+    async def dispatch(self, payload: Payload) -> Optional[Any]:
+        """call the handler of the payload, returns the passive reply"""
+        handler = self.match(payload)
+        if handler is None:
+            return None
+        return await handler(payload)
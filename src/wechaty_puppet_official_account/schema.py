@@ -20,7 +20,7 @@ limitations under the License.
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Literal, List
+from typing import Any, Dict, Literal, List, Optional
 from datetime import datetime
 
 from wechaty_puppet import ContactGender
@@ -56,6 +56,26 @@ class OAMessagePayload:
     MsgId: str
 
 
+@dataclass
+class OAEventPayload:
+    """
+    the event push, eg: subscribe, SCAN, CLICK, VIEW, scancode_push
+
+    https://developers.weixin.qq.com/doc/offiaccount/Message_Management/Receiving_event_pushes.html
+    """
+    ToUserName: str
+    FromUserName: str
+    CreateTime: str
+    MsgType: Literal['event']
+    Event: str
+    EventKey: Optional[str] = None
+    Ticket: Optional[str] = None
+    ScanCodeInfo: Optional[Dict[str, Any]] = None
+    # the result of the template message: TEMPLATESENDJOBFINISH
+    MsgID: Optional[str] = None
+    Status: Optional[str] = None
+
+
 @dataclass
 class OAContactPayload:
     subscribe: int
@@ -76,6 +96,17 @@ class OAContactPayload:
     qr_scene: int
     qr_scene_str: str
 
+
+@dataclass
+class QRCodePayload:
+    """the parametric qr code, expire_seconds is None for the permanent one"""
+    scene: str
+    ticket: str
+    url: str
+    expire_seconds: Optional[int]
+    create_time: int
+
+
 @dataclass
 class VerifyArgs:
     timestamp: int
@@ -0,0 +1,288 @@
+"""
+Python Wechaty - https://github.com/wechaty/python-wechaty
+
+Authors:    Jingjing WU (吴京京) <https://github.com/wj-Mcat>
+
+2020-now @ Copyright Wechaty
+
+Licensed under the Apache License, Version 2.0 (the 'License');
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an 'AS IS' BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+from uuid import uuid4
+
+from diskcache import Cache, Index
+from wechaty_puppet import get_logger, WechatyPuppetOperationError
+
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+
+logger = get_logger('OutboundQueue')
+
+# https://developers.weixin.qq.com/doc/offiaccount/Getting_Started/Global_Return_Code.html
+# errcodes which tell that the same request may succeed later
+TOKEN_ERRCODES = frozenset([
+    40001,  # invalid credential, the access_token is invalid
+    40014,  # invalid access_token
+    42001,  # access_token expired
+])
+RETRYABLE_ERRCODES = frozenset([
+    -1,     # system busy
+    45009,  # reach max api daily quota limit
+    45011,  # api minute-quota reach limit
+]) | TOKEN_ERRCODES
+
+
+def is_retryable(errcode: int) -> bool:
+    """check if the request with errcode can be retried later"""
+    return errcode in RETRYABLE_ERRCODES
+
+
+@dataclass
+class OutboundMessage:
+    """the message which is waiting to be sent to the official account api"""
+    id: str
+    openid: str
+    msgtype: str
+    content: Dict[str, Any]
+    seq: int
+    attempts: int = 0
+    last_error: Optional[str] = None
+
+
+@dataclass
+class OutboundQueueOption:
+    # the max number of the in-flight api requests
+    concurrency: int = 8
+    # the message will be moved to dead letters after max_attempts
+    max_attempts: int = 8
+    # seconds of the exponential backoff: uniform(0, min(max, base * 2 ** n))
+    backoff_base: float = 1.0
+    backoff_max: float = 300.0
+    # seconds to keep the idempotency keys of the sent messages
+    done_ttl: int = 7 * 24 * 3600
+    # the new messages are rejected when there are max_pending messages
+    max_pending: Optional[int] = 100000
+    # seconds to hold the message while the circuit is open, then it is moved to dead letters
+    max_hold: float = 300.0
+
+
+Sender = Callable[[OutboundMessage], Awaitable[dict]]
+
+
+class OutboundQueue:
+    """
+    persistent outbound queue with at-least-once delivery
+
+    messages to the same openid are delivered in order, messages to different
+    openids are delivered concurrently.
+
+    when the circuit breaker of the api is open, the new messages are rejected
+    with CircuitOpenError and the pending ones are held, or moved to dead
+    letters after max_hold seconds.
+    """
+
+    def __init__(self, directory: str, sender: Sender,
+                 option: Optional[OutboundQueueOption] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        if not option:
+            option = OutboundQueueOption()
+        self.option: OutboundQueueOption = option
+
+        self._sender: Sender = sender
+        self._breaker: Optional[CircuitBreaker] = breaker
+        self._pending: Index = Index(os.path.join(directory, 'pending'))
+        self._dead: Index = Index(os.path.join(directory, 'dead'))
+        self._done: Cache = Cache(os.path.join(directory, 'done'))
+
+        self._lanes: Dict[str, Deque[str]] = {}
+        self._lane_tasks: Dict[str, asyncio.Task] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._last_seq: int = 0
+        # key -> the monotonic time when the message is held by the open circuit
+        self._held: Dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    @property
+    def running(self) -> bool:
+        """check if the queue is delivering messages"""
+        return self._semaphore is not None
+
+    def _next_seq(self) -> int:
+        """the sequence keeps the order of the messages across restarts"""
+        self._last_seq = max(time.time_ns(), self._last_seq + 1)
+        return self._last_seq
+
+    def put(self, openid: str, msgtype: str, content: Dict[str, Any],
+            idempotency_key: Optional[str] = None) -> str:
+        """
+        persist the message and schedule it, returns the idempotency key
+
+        the message will be ignored if the same idempotency key is pending or
+        has been sent.
+        """
+        key = idempotency_key or uuid4().hex
+        if key in self._pending or key in self._done:
+            logger.debug('put() message <%s> is already queued or sent', key)
+            return key
+        if self._breaker is not None and self._breaker.is_open:
+            raise CircuitOpenError(self._breaker.name, self._breaker.retry_after)
+        if self.option.max_pending is not None and len(self._pending) >= self.option.max_pending:
+            raise WechatyPuppetOperationError(f'outbound queue is full with <{len(self._pending)}> messages')
+
+        message = OutboundMessage(
+            id=key,
+            openid=openid,
+            msgtype=msgtype,
+            content=content,
+            seq=self._next_seq()
+        )
+        self._pending[key] = asdict(message)
+        self._schedule(openid, key)
+        return key
+
+    def is_sent(self, key: str) -> bool:
+        """check if the message has been sent successfully"""
+        return key in self._done
+
+    def dead_letters(self) -> List[OutboundMessage]:
+        """get the messages which can not be delivered"""
+        return [OutboundMessage(**data) for data in self._dead.values()]
+
+    def _schedule(self, openid: str, key: str):
+        """append the message to the lane of the openid"""
+        lane = self._lanes.setdefault(openid, deque())
+        lane.append(key)
+        if self.running and openid not in self._lane_tasks:
+            self._lane_tasks[openid] = asyncio.ensure_future(self._run_lane(openid))
+
+    async def start(self):
+        """load the pending messages from disk and start delivering"""
+        if self.running:
+            return
+        self._semaphore = asyncio.Semaphore(self.option.concurrency)
+
+        messages = sorted(self._pending.values(), key=lambda data: data['seq'])
+        logger.info('start() restore <%d> pending messages', len(messages))
+
+        self._lanes = {}
+        for data in messages:
+            self._last_seq = max(self._last_seq, data['seq'])
+            self._lanes.setdefault(data['openid'], deque()).append(data['id'])
+
+        for openid in self._lanes:
+            self._lane_tasks[openid] = asyncio.ensure_future(self._run_lane(openid))
+
+    async def stop(self):
+        """stop delivering, the pending messages are kept on disk"""
+        self._semaphore = None
+        tasks = list(self._lane_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._lane_tasks.clear()
+
+    async def join(self):
+        """wait until all of the scheduled messages are settled"""
+        while self._lane_tasks:
+            await asyncio.gather(*self._lane_tasks.values(), return_exceptions=True)
+
+    async def _run_lane(self, openid: str):
+        """deliver the messages of the openid one by one"""
+        lane = self._lanes[openid]
+        try:
+            while lane:
+                await self._deliver(lane[0])
+                lane.popleft()
+        finally:
+            self._lane_tasks.pop(openid, None)
+            if not lane:
+                self._lanes.pop(openid, None)
+
+    def _backoff(self, attempts: int) -> float:
+        """exponential backoff with full jitter"""
+        ceiling = min(self.option.backoff_max, self.option.backoff_base * 2 ** attempts)
+        return random.uniform(0, ceiling)
+
+    async def _deliver(self, key: str):
+        """send the message until it succeeds or fails permanently"""
+        while True:
+            data = self._pending.get(key, None)
+            if data is None:
+                return
+            if key in self._done:
+                del self._pending[key]
+                return
+
+            message = OutboundMessage(**data)
+            assert self._semaphore is not None
+            async with self._semaphore:
+                try:
+                    response = await self._sender(message)
+                    errcode = response.get('errcode', 0)
+                    errmsg = response.get('errmsg', '')
+                except asyncio.CancelledError:
+                    raise
+                except CircuitOpenError as error:
+                    # the api is not called, so hold the message without counting the attempt
+                    retry_after = error.retry_after
+                    errcode = None
+                except Exception as exception:  # pylint: disable=broad-except
+                    errcode, errmsg = -1, str(exception)
+
+            if errcode is None:
+                now = time.monotonic()
+                held_since = self._held.setdefault(key, now)
+                if now - held_since >= self.option.max_hold:
+                    logger.error('_deliver() drop message <%s> held for %.0fs: circuit is open',
+                                 key, self.option.max_hold)
+                    message.last_error = 'circuit is open'
+                    self._dead[key] = asdict(message)
+                    del self._pending[key]
+                    del self._held[key]
+                    return
+                logger.debug('_deliver() hold message <%s> for %.2fs: circuit is open', key, retry_after)
+                await asyncio.sleep(min(retry_after + self._backoff(0),
+                                        held_since + self.option.max_hold - now))
+                continue
+
+            if errcode == 0:
+                self._done.set(key, time.time(), expire=self.option.done_ttl)
+                del self._pending[key]
+                self._held.pop(key, None)
+                return
+
+            message.attempts += 1
+            message.last_error = f'{errcode}: {errmsg}'
+
+            if not is_retryable(errcode) or message.attempts >= self.option.max_attempts:
+                logger.error('_deliver() drop message <%s> after <%d> attempts: %s',
+                             key, message.attempts, message.last_error)
+                self._dead[key] = asdict(message)
+                del self._pending[key]
+                self._held.pop(key, None)
+                return
+
+            self._pending[key] = asdict(message)
+            delay = self._backoff(message.attempts)
+            logger.warning('_deliver() retry message <%s> in %.2fs: %s',
+                           key, delay, message.last_error)
+            await asyncio.sleep(delay)
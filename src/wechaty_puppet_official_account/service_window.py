@@ -0,0 +1,128 @@
+"""
+Python Wechaty - https://github.com/wechaty/python-wechaty
+
+Authors:    Jingjing WU (吴京京) <https://github.com/wj-Mcat>
+
+2020-now @ Copyright Wechaty
+
+Licensed under the Apache License, Version 2.0 (the 'License');
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an 'AS IS' BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import time
+from typing import Dict, Optional
+
+from diskcache import Cache
+from wechaty_puppet import get_logger
+
+from .data_store import DataStore
+
+logger = get_logger('ServiceWindow')
+
+# https://developers.weixin.qq.com/doc/offiaccount/Message_Management/Service_Center_messages.html
+# the customer service message can only be sent in 48 hours after the user interaction
+SERVICE_WINDOW_SECONDS = 48 * 3600
+
+# the events of the user interactions which open the window, in upper case
+WINDOW_EVENTS = frozenset([
+    'SUBSCRIBE',
+    'SCAN',
+    'CLICK',
+    'SCANCODE_PUSH',
+    'SCANCODE_WAITMSG',
+])
+
+# errcode of the customer service api when the window is closed
+OUT_OF_WINDOW_ERRCODE = 45015
+
+
+class ServiceWindow:
+    """
+    the index of openid -> last interaction timestamp
+
+    the timestamps are written through to the store, which is shared by the
+    instances behind the load balancer and evicts them when the window is
+    closed. the open windows are also kept in memory, the interactions only
+    move the timestamps forward so the open ones never go stale.
+    """
+
+    def __init__(self, store: DataStore, window: int = SERVICE_WINDOW_SECONDS):
+        self.window: int = window
+        self._store: DataStore = store
+        self._last_interaction: Dict[str, int] = {}
+
+    @staticmethod
+    def _key(openid: str) -> str:
+        return f'service_window-{openid}'
+
+    def touch(self, openid: str, timestamp: Optional[int] = None):
+        """record the interaction of the user"""
+        now = int(time.time())
+        if timestamp is None:
+            timestamp = now
+
+        if timestamp <= self._last_interaction.get(openid, 0):
+            return
+        # the newer interaction may be in the store only, eg: received by the others
+        if timestamp <= (self._load(openid) or 0):
+            return
+        self._last_interaction[openid] = timestamp
+
+        expire = timestamp + self.window - now
+        if expire > 0:
+            self._store.set(self._key(openid), timestamp, expire=expire)
+
+    def _load(self, openid: str) -> Optional[int]:
+        """load the timestamp from the store into memory"""
+        timestamp = self._store.get(self._key(openid))
+        if timestamp is not None and timestamp > self._last_interaction.get(openid, 0):
+            self._last_interaction[openid] = timestamp
+        return self._last_interaction.get(openid, None)
+
+    def last_interaction(self, openid: str) -> Optional[int]:
+        """get the timestamp of the last interaction of the user"""
+        return self._load(openid)
+
+    def is_open(self, openid: str, now: Optional[float] = None) -> bool:
+        """check if the customer service message can be sent to the user"""
+        if now is None:
+            now = time.time()
+        timestamp = self._last_interaction.get(openid, None)
+        if timestamp is None or now >= timestamp + self.window:
+            # the window may be opened by the interaction received by the others
+            timestamp = self._load(openid)
+        if timestamp is None:
+            return False
+        return now < timestamp + self.window
+
+    def migrate(self, directory: str):
+        """move the windows recorded in the local diskcache by the previous versions into the store"""
+        if not os.path.isdir(directory):
+            return
+        with Cache(directory) as cache:
+            for openid in list(cache):
+                timestamp = cache.get(openid, None)
+                if timestamp is not None:
+                    self.touch(openid, timestamp)
+        shutil.rmtree(directory, ignore_errors=True)
+        logger.info('migrate() the windows in <%s> are moved into the store', directory)
+
+    def evict(self):
+        """drop the closed windows from memory, the store expires them by itself"""
+        deadline = time.time() - self.window
+        closed = [openid for openid, timestamp in self._last_interaction.items() if timestamp <= deadline]
+        for openid in closed:
+            del self._last_interaction[openid]
+        logger.debug('evict() drop <%d> closed windows', len(closed))
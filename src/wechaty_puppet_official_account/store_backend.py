@@ -0,0 +1,202 @@
+"""
+Python Wechaty - https://github.com/wechaty/python-wechaty
+
+Authors:    Jingjing WU (吴京京) <https://github.com/wj-Mcat>
+
+2020-now @ Copyright Wechaty
+
+Licensed under the Apache License, Version 2.0 (the 'License');
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an 'AS IS' BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from __future__ import annotations
+
+import time
+from typing import Any, Optional
+from uuid import uuid4
+
+from diskcache import Cache
+from wechaty_puppet import (
+    get_logger,
+    WechatyPuppetConfigurationError,
+    WechatyPuppetOperationError
+)
+
+try:
+    import redis
+except ImportError:  # pragma: no cover
+    redis = None
+
+logger = get_logger('StoreBackend')
+
+# seconds to wait for the redis server, the token & payloads are read on the event loop
+REDIS_SOCKET_TIMEOUT = 5.0
+
+
+class StoreLock:
+    """
+    the lock which is shared by the instances using the same backend
+
+    the lock expires after `timeout` seconds, so that a crashed holder will not
+    block the others forever.
+    """
+
+    def __init__(self, name: str, timeout: float, blocking_timeout: float):
+        self.name: str = name
+        self.timeout: float = timeout
+        self.blocking_timeout: float = blocking_timeout
+        self._token: Optional[str] = None
+
+    def _try_acquire(self, token: str) -> bool:
+        raise NotImplementedError
+
+    def _release(self, token: str):
+        raise NotImplementedError
+
+    def acquire(self):
+        """acquire the lock, or raise error after blocking_timeout seconds"""
+        token = uuid4().hex
+        deadline = time.monotonic() + self.blocking_timeout
+        while not self._try_acquire(token):
+            if time.monotonic() > deadline:
+                raise WechatyPuppetOperationError(f'can not acquire the lock <{self.name}>')
+            time.sleep(0.05)
+        self._token = token
+
+    def release(self):
+        """release the lock if it is still held by this instance"""
+        if self._token:
+            self._release(self._token)
+            self._token = None
+
+    def __enter__(self) -> StoreLock:
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class StoreBackend:
+    """the key-value store under the DataStore"""
+
+    def get(self, key: str) -> Optional[Any]:
+        """get the data by key"""
+        raise NotImplementedError
+
+    def set(self, key: str, data: bytes, expire: Optional[float] = None):
+        """set the data by key, which expires after `expire` seconds"""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        """delete the data by key"""
+        raise NotImplementedError
+
+    def lock(self, name: str, timeout: float = 30, blocking_timeout: float = 30) -> StoreLock:
+        """get the lock by name"""
+        raise NotImplementedError
+
+
+class _DiskCacheLock(StoreLock):
+    def __init__(self, cache: Cache, name: str, timeout: float, blocking_timeout: float):
+        super().__init__(name, timeout, blocking_timeout)
+        self._cache: Cache = cache
+
+    def _try_acquire(self, token: str) -> bool:
+        return self._cache.add(self.name, token, expire=self.timeout)
+
+    def _release(self, token: str):
+        with self._cache.transact():
+            if self._cache.get(self.name, None) == token:
+                self._cache.delete(self.name)
+
+
+class DiskCacheBackend(StoreBackend):
+    """the local backend, which is shared by the processes on the same host"""
+
+    def __init__(self, directory: str):
+        self.directory: str = directory
+        self._cache: Cache = Cache(directory)
+
+    def get(self, key: str) -> Optional[Any]:
+        return self._cache.get(key, None)
+
+    def set(self, key: str, data: bytes, expire: Optional[float] = None):
+        self._cache.set(key, data, expire=expire)
+
+    def delete(self, key: str):
+        self._cache.delete(key)
+
+    def lock(self, name: str, timeout: float = 30, blocking_timeout: float = 30) -> StoreLock:
+        return _DiskCacheLock(self._cache, f'lock:{name}', timeout, blocking_timeout)
+
+
+class _RedisLock(StoreLock):
+    def __init__(self, client: Any, name: str, timeout: float, blocking_timeout: float):
+        super().__init__(name, timeout, blocking_timeout)
+        self._client = client
+
+    def _try_acquire(self, token: str) -> bool:
+        return bool(self._client.set(self.name, token, nx=True, px=int(self.timeout * 1000)))
+
+    def _release(self, token: str):
+        # compare-and-delete in the transaction, the lock may be expired and held by others
+        with self._client.pipeline() as pipe:
+            try:
+                pipe.watch(self.name)
+                if pipe.get(self.name) == token.encode():
+                    pipe.multi()
+                    pipe.delete(self.name)
+                    pipe.execute()
+            except redis.WatchError:
+                logger.warning('_release() lock <%s> is changed while releasing', self.name)
+
+
+class RedisBackend(StoreBackend):
+    """
+    the backend of redis-protocol server, which is shared by the instances on
+    different hosts
+
+    pip install redis
+    """
+
+    def __init__(self, client: Any, prefix: str = 'wechaty-puppet-official-account:'):
+        if redis is None:
+            raise WechatyPuppetConfigurationError('please install redis to use RedisBackend: pip install redis')
+        self._client = client
+        self.prefix: str = prefix
+
+    @classmethod
+    def from_url(cls, url: str, prefix: str = 'wechaty-puppet-official-account:',
+                 socket_timeout: float = REDIS_SOCKET_TIMEOUT) -> RedisBackend:
+        """
+        create the backend from url, eg: redis://localhost:6379/0
+
+        the commands fail after socket_timeout seconds instead of blocking the
+        caller when the redis server is unreachable.
+        """
+        if redis is None:
+            raise WechatyPuppetConfigurationError('please install redis to use RedisBackend: pip install redis')
+        client = redis.Redis.from_url(url, socket_timeout=socket_timeout, socket_connect_timeout=socket_timeout)
+        return cls(client, prefix)
+
+    def get(self, key: str) -> Optional[Any]:
+        return self._client.get(self.prefix + key)
+
+    def set(self, key: str, data: bytes, expire: Optional[float] = None):
+        px = int(expire * 1000) if expire else None
+        self._client.set(self.prefix + key, data, px=px)
+
+    def delete(self, key: str):
+        self._client.delete(self.prefix + key)
+
+    def lock(self, name: str, timeout: float = 30, blocking_timeout: float = 30) -> StoreLock:
+        return _RedisLock(self._client, f'{self.prefix}lock:{name}', timeout, blocking_timeout)
@@ -0,0 +1,106 @@
+"""
+Python Wechaty - https://github.com/wechaty/python-wechaty
+
+Authors:    Jingjing WU (吴京京) <https://github.com/wj-Mcat>
+
+2020-now @ Copyright Wechaty
+
+Licensed under the Apache License, Version 2.0 (the 'License');
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an 'AS IS' BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+from wechaty_puppet import WechatyPuppetOperationError
+
+
+@dataclass
+class TemplateSendResult:
+    """the result of message/template/send, msgid is None when it failed"""
+    openid: str
+    msgid: Optional[int]
+    errcode: int = 0
+    errmsg: str = 'ok'
+
+
+def _dumps(value: object) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+class MessageTemplate:
+    """
+    the template message with pre-serialized static parts
+
+    https://developers.weixin.qq.com/doc/offiaccount/Message_Management/Template_Message_Interface.html
+
+    the json body is compiled into chunks at registration, so rendering only
+    serializes the openid and the field values and joins them with chunks.
+    """
+
+    def __init__(self, template_id: str, fields: Sequence[str],
+                 url: Optional[str] = None,
+                 mini_program: Optional[Dict[str, str]] = None,
+                 colors: Optional[Dict[str, str]] = None):
+        if not template_id:
+            raise WechatyPuppetOperationError('template_id can not be empty')
+        if not fields:
+            raise WechatyPuppetOperationError(f'template<{template_id}> has no fields')
+        if len(set(fields)) != len(fields):
+            raise WechatyPuppetOperationError(f'template<{template_id}> has duplicated fields <{fields}>')
+        if any(not field for field in fields):
+            raise WechatyPuppetOperationError(f'template<{template_id}> has empty field name')
+
+        colors = colors or {}
+        unknown_colors = set(colors) - set(fields)
+        if unknown_colors:
+            raise WechatyPuppetOperationError(f'template<{template_id}> has colors of unknown fields <{unknown_colors}>')
+
+        self.template_id: str = template_id
+        self.fields: Sequence[str] = tuple(fields)
+
+        static = f',"template_id":{_dumps(template_id)}'
+        if url:
+            static += f',"url":{_dumps(url)}'
+        if mini_program:
+            static += f',"miniprogram":{_dumps(mini_program)}'
+
+        # chunks[i] is followed by the value of fields[i], the first chunk is followed by openid
+        chunks: List[str] = ['{"touser":']
+        prefix = static + ',"data":{'
+        for field in self.fields:
+            chunks.append(f'{prefix}{_dumps(field)}:{{"value":')
+            prefix = f',"color":{_dumps(colors[field])}}},' if field in colors else '},'
+        chunks.append(prefix[:-1] + '}}')
+        self._chunks: List[str] = chunks
+
+    def render(self, openid: str, values: Dict[str, str]) -> bytes:
+        """render the json body of the template message for the user"""
+        if len(values) != len(self.fields):
+            missing = set(self.fields) - set(values)
+            unknown = set(values) - set(self.fields)
+            raise WechatyPuppetOperationError(
+                f'template<{self.template_id}> values missing <{missing}>, unknown <{unknown}>')
+
+        chunks = self._chunks
+        parts = [chunks[0], _dumps(openid)]
+        try:
+            for index, field in enumerate(self.fields, 1):
+                parts.append(chunks[index])
+                parts.append(_dumps(values[field]))
+        except KeyError as error:
+            raise WechatyPuppetOperationError(
+                f'template<{self.template_id}> value of field <{error}> not found') from error
+        parts.append(chunks[-1])
+        return ''.join(parts).encode('utf-8')
@@ -20,19 +20,23 @@ limitations under the License.
 from __future__ import annotations
 
 import asyncio
+import hashlib
+import hmac
+import time
+from xml.etree import ElementTree
 
 from aiohttp.web_runner import BaseSite
 from pyee import AsyncIOEventEmitter
 from aiohttp import web
 from aiohttp.web_request import Request
-from dataclasses import dataclass
-from typing import Callable, Optional
+from dataclasses import dataclass, fields
+from typing import Any, Callable, Dict, Mapping, Optional
 from wechaty_puppet import get_logger, WechatyPuppetOperationError
 
-from Crypto.Hash import SHA1
 import xmltodict
 
-from .schema import VerifyArgs, OAMessagePayload
+from .router import Router, Payload
+from .schema import OAMessagePayload, OAEventPayload
 
 
 @dataclass
@@ -42,6 +46,51 @@ class WebhookOptions:
 
 logger = get_logger('Webhook')
 
+_EVENT_FIELDS = frozenset(field.name for field in fields(OAEventPayload))
+
+
+def _element_to_dict(element: ElementTree.Element) -> Dict[str, Any]:
+    return {
+        child.tag: _element_to_dict(child) if len(child) else child.text
+        for child in element
+    }
+
+
+def parse_xml(body: bytes) -> Dict[str, Any]:
+    """parse the xml body into dict, eg: <xml><MsgType>text</MsgType></xml>"""
+    return _element_to_dict(ElementTree.fromstring(body))
+
+
+def parse_payload(xml: Dict[str, Any]) -> Payload:
+    """parse the message or event payload from the xml data"""
+    if xml.get('MsgType', None) == 'event':
+        return OAEventPayload(**{key: value for key, value in xml.items() if key in _EVENT_FIELDS})
+
+    # only the text message has Content
+    return OAMessagePayload(
+        ToUserName=xml['ToUserName'],
+        FromUserName=xml['FromUserName'],
+        CreateTime=xml['CreateTime'],
+        MsgType=xml['MsgType'],
+        Content=xml.get('Content', None) or '',
+        MsgId=xml['MsgId']
+    )
+
+
+def render_text_reply(payload: Payload, text: str) -> str:
+    """
+    render the passive text reply of the payload
+
+    https://developers.weixin.qq.com/doc/offiaccount/Message_Management/Passive_user_reply_message.html
+    """
+    return xmltodict.unparse({'xml': {
+        'ToUserName': payload.FromUserName,
+        'FromUserName': payload.ToUserName,
+        'CreateTime': int(time.time()),
+        'MsgType': 'text',
+        'Content': text
+    }}, full_document=False)
+
 
 class Webhook(AsyncIOEventEmitter):
     """
@@ -52,48 +101,78 @@ class Webhook(AsyncIOEventEmitter):
         super().__init__()
         self.options: WebhookOptions = options
         self.site: Optional[BaseSite] = None
+        self.router: Router = Router()
 
-    def init_site(self):
-        """init the web site configuration"""
+    def create_app(self) -> web.Application:
+        """create the web application of the webhook"""
         routes = web.RouteTableDef()
 
         @routes.get('/')
         async def verify_auth(request: Request):
             """check the authentication"""
-            query_json = dict(request.query)
-            logger.debug("receive query from tencent server <%s>", request.query_string)
-            verify_args = VerifyArgs(**query_json)
-            data = [verify_args.timestamp, verify_args.nonce, self.options.token]
-            sha1 = SHA1.new()
-            sha1.update(''.join(data).encode())
-            hash_data = sha1.hexdigest()
-            text = verify_args.echostr if hash_data == verify_args.signature else ''
-            logger.debug(f'final auth text result : {text}')
-            return web.Response(body=text)
+            return web.Response(text=self.verify_auth(request.query))
 
         @routes.post('/')
         async def receive_message(request: Request):
-            data = await request.text()
-            logger.debug(f'receive message <{data}>')
-
-            payload_json = xmltodict.parse(data)
-
-            payload = OAMessagePayload(**payload_json['xml'])
-
-            if payload.MsgType in ['text', 'image']:
-                self.emit('message', payload)
+            # reject the forged requests before parsing the body
+            if not self.check_signature(request.query):
+                logger.warning('receive_message() reject the request with invalid signature')
+                return web.Response(status=403)
+            reply = await self.receive_message(await request.read())
+            if reply:
+                return web.Response(text=reply, content_type='application/xml')
+            return web.Response(text='success')
 
         app = web.Application()
         app.add_routes(routes)
+        return app
 
-        runner = web.AppRunner(app)
+    async def init_site(self):
+        """init the web site configuration"""
+        runner = web.AppRunner(self.create_app())
         await runner.setup()
 
         self.site = web.TCPSite(runner, '0.0.0.0', self.options.port)
 
-    @staticmethod
-    async def receive_message(request):
-        pass
+    def check_signature(self, query: Mapping[str, str]) -> bool:
+        """
+        check the signature of the request from the official account server
+
+        https://developers.weixin.qq.com/doc/offiaccount/Basic_Information/Access_Overview.html
+        """
+        items = sorted([self.options.token, query.get('timestamp', ''), query.get('nonce', '')])
+        signature = hashlib.sha1(''.join(items).encode()).hexdigest()
+        return hmac.compare_digest(signature, query.get('signature', ''))
+
+    def verify_auth(self, query: Mapping[str, str]) -> str:
+        """check the signature of the request, returns the echostr if it passes"""
+        logger.debug('verify_auth() receive query <%s>', query)
+        if not self.check_signature(query):
+            logger.warning('verify_auth() invalid signature')
+            return ''
+        return query.get('echostr', '')
+
+    async def receive_message(self, body: bytes) -> Optional[str]:
+        """handle the message or event, returns the passive reply"""
+        logger.debug('receive_message() receive message <%s>', body)
+
+        payload = parse_payload(parse_xml(body))
+
+        if isinstance(payload, OAEventPayload):
+            self.emit('event', payload)
+        else:
+            self.emit('message', payload)
+
+        try:
+            reply = await self.router.dispatch(payload)
+        except Exception:  # pylint: disable=broad-except
+            # reply success anyway, otherwise the server will push the payload again
+            logger.exception('receive_message() the handler of <%s> failed', payload)
+            return None
+
+        if reply:
+            return render_text_reply(payload, reply)
+        return None
 
     async def start(self):
         """
@@ -103,14 +182,17 @@ class Webhook(AsyncIOEventEmitter):
 
         async def run_server():
             if not self.site:
-                raise WechatyPuppetOperationError(f'please init the site configuration before starting the site ...')
+                await self.init_site()
+            if not self.site:
+                raise WechatyPuppetOperationError('please init the site configuration before starting the site ...')
             await self.site.start()
 
         loop = asyncio.get_event_loop()
         asyncio.run_coroutine_threadsafe(run_server(), loop=loop)
-        logger.info(f'the server started at: http://0.0.0.0:{self.options.port}')
+        logger.info('the server started at: http://0.0.0.0:%s', self.options.port)
         logger.info('webhook server started ...')
 
     async def stop(self):
         """stopping web application"""
-        await self.site.stop()
+        if self.site is not None:
+            await self.site.stop()
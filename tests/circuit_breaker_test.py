@@ -0,0 +1,323 @@
+"""
+Unit Test for the circuit breakers against the fault-injecting mock api server
+"""
+# pylint: disable=W0621
+import asyncio
+import socket
+from datetime import datetime
+from typing import Any, Dict, List
+
+import pytest   # type: ignore
+from aiohttp import web
+from wechaty_puppet import WechatyPuppetError
+
+from wechaty_puppet_official_account.circuit_breaker import (
+    CircuitBreaker,
+    CircuitBreakerOption,
+    CircuitOpenError
+)
+from wechaty_puppet_official_account.official_account import (
+    OfficialAccount,
+    OfficialAccountOption
+)
+from wechaty_puppet_official_account.schema import AccessTokenPayload
+from wechaty_puppet_official_account.send_queue import (
+    OutboundMessage,
+    OutboundQueue,
+    OutboundQueueOption
+)
+
+
+@pytest.fixture
+def option() -> CircuitBreakerOption:
+    """fast recovery in unit tests"""
+    return CircuitBreakerOption(failure_threshold=2, recovery_timeout=0.2, timeout=0.1)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class MockServer:
+    """the official account api which fails on demand"""
+
+    def __init__(self):
+        self.port: int = _free_port()
+        # ok | slow | busy | error
+        self.mode: str = 'ok'
+        self.requests: List[str] = []
+        self._runner: Any = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests.append(request.path)
+        if self.mode == 'slow':
+            await asyncio.sleep(1)
+        if self.mode == 'error':
+            return web.Response(status=500)
+        if request.path.endswith('/token'):
+            return web.json_response({'access_token': 'fresh-token', 'expires_in': 7200})
+        if self.mode == 'busy':
+            return web.json_response({'errcode': -1, 'errmsg': 'system busy'})
+        return web.json_response({'errcode': 0, 'errmsg': 'ok'})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route('*', '/{path:.*}', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, '127.0.0.1', self.port).start()
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+
+def _official_account(tmp_path, server: MockServer, option: CircuitBreakerOption,
+                      expires_in: int = 7200) -> OfficialAccount:
+    official_account = OfficialAccount(OfficialAccountOption(
+        app_id='app-id',
+        app_secret='app-secret',
+        port=_free_port(),
+        token='token',
+        cache_dir=str(tmp_path),
+        server_base_url=f'http://127.0.0.1:{server.port}/cgi-bin/',
+        circuit_breaker=option
+    ))
+    official_account._data_store.set_access_token_payload(AccessTokenPayload(
+        expires_in=expires_in,
+        refresh_time=datetime.now(),
+        token='cached-token'
+    ))
+    return official_account
+
+
+def test_state_transitions(option) -> None:
+    """closed -> open -> half_open -> closed, and half_open -> open"""
+    breaker = CircuitBreaker('message', option)
+
+    async def fail() -> None:
+        raise WechatyPuppetError('boom')
+
+    async def succeed() -> str:
+        return 'ok'
+
+    async def run():
+        for _ in range(option.failure_threshold):
+            with pytest.raises(WechatyPuppetError):
+                await breaker.call(fail)
+        assert breaker.state == 'open'
+        with pytest.raises(CircuitOpenError) as error:
+            await breaker.call(succeed)
+        assert 0 < error.value.retry_after <= option.recovery_timeout
+
+        # the failed probing call opens the circuit again
+        await asyncio.sleep(option.recovery_timeout)
+        with pytest.raises(WechatyPuppetError):
+            await breaker.call(fail)
+        assert breaker.state == 'open'
+
+        await asyncio.sleep(option.recovery_timeout)
+        assert await breaker.call(succeed) == 'ok'
+        assert breaker.state == 'closed'
+
+    asyncio.run(run())
+
+
+def test_timeout_opens_and_probe_closes(tmp_path, option) -> None:
+    """slow api times out, then requests fail fast until the probe succeeds"""
+    server = MockServer()
+
+    async def run():
+        await server.start()
+        official_account = _official_account(tmp_path, server, option)
+        try:
+            server.mode = 'slow'
+            for _ in range(option.failure_threshold):
+                with pytest.raises(WechatyPuppetError):
+                    await official_account.send_custom_message('openid', 'text', {'content': 'hi'})
+            assert official_account.breakers.states() == {'message': 'open'}
+
+            # fail fast without calling the api
+            count = len(server.requests)
+            with pytest.raises(CircuitOpenError):
+                await official_account.send_custom_message('openid', 'text', {'content': 'hi'})
+            assert len(server.requests) == count
+
+            # the other api families are not affected
+            server.mode = 'ok'
+            await official_account._post_json('qrcode/create', {})
+
+            await asyncio.sleep(option.recovery_timeout)
+            response = await official_account.send_custom_message('openid', 'text', {'content': 'hi'})
+            assert response['errcode'] == 0
+            assert official_account.breakers.states() == {'message': 'closed', 'qrcode': 'closed'}
+        finally:
+            await official_account.stop()
+            await server.stop()
+
+    asyncio.run(run())
+
+
+def test_system_busy_counts_as_failure(tmp_path, option) -> None:
+    """errcode -1 is returned to the caller and counted by the breaker"""
+    server = MockServer()
+
+    async def run():
+        await server.start()
+        official_account = _official_account(tmp_path, server, option)
+        try:
+            server.mode = 'busy'
+            for _ in range(option.failure_threshold):
+                response = await official_account.send_custom_message('openid', 'text', {'content': 'hi'})
+                assert response['errcode'] == -1
+            assert official_account.breakers.get('message').state == 'open'
+        finally:
+            await official_account.stop()
+            await server.stop()
+
+    asyncio.run(run())
+
+
+def test_token_refresh_failure_keeps_cached_token(tmp_path, option) -> None:
+    """the cached token is served while the token api is retried in background"""
+    server = MockServer()
+
+    async def run():
+        await server.start()
+        # the token expires within the refresh margin, so it should be refreshed
+        official_account = _official_account(tmp_path, server, option, expires_in=300)
+        try:
+            server.mode = 'error'
+            await official_account._update_access_token()
+            assert official_account.access_token == 'cached-token'
+
+            server.mode = 'ok'
+            assert official_account._token_retry_task is not None
+            await asyncio.wait_for(official_account._token_retry_task, timeout=5)
+            assert official_account.access_token == 'fresh-token'
+        finally:
+            await official_account.stop()
+            await server.stop()
+
+    asyncio.run(run())
+
+
+def test_access_token_cached_in_memory(tmp_path, option) -> None:
+    """the token is read from the store again only after it is refreshed"""
+    server = MockServer()
+
+    async def run():
+        await server.start()
+        official_account = _official_account(tmp_path, server, option)
+        try:
+            assert official_account.access_token == 'cached-token'
+            official_account._data_store.backend.delete('access_token')
+            assert official_account.access_token == 'cached-token'
+
+            # the api tells the token is invalid, eg: refreshed by the other instance
+            await official_account._update_access_token(stale_token='cached-token')
+            assert official_account.access_token == 'fresh-token'
+        finally:
+            await official_account.stop()
+            await server.stop()
+
+    asyncio.run(run())
+
+
+def test_token_lock_contention_is_not_failure(tmp_path, option) -> None:
+    """waiting for the lock held by the other instance longer than the timeout"""
+    server = MockServer()
+
+    async def run():
+        await server.start()
+        official_account = _official_account(tmp_path, server, option, expires_in=0)
+        try:
+            lock = official_account._data_store.lock('access_token', timeout=5)
+            lock.acquire()
+            asyncio.get_event_loop().call_later(option.timeout * 2, lock.release)
+            await official_account._update_access_token()
+            assert official_account.access_token == 'fresh-token'
+            assert official_account.breakers.get('token').state == 'closed'
+        finally:
+            await official_account.stop()
+            await server.stop()
+
+    asyncio.run(run())
+
+
+def test_expired_token_refresh_failure_raises(tmp_path, option) -> None:
+    """the error is raised when there is no valid token to fall back to"""
+    server = MockServer()
+
+    async def run():
+        await server.start()
+        official_account = _official_account(tmp_path, server, option, expires_in=0)
+        try:
+            server.mode = 'error'
+            with pytest.raises(WechatyPuppetError):
+                await official_account._update_access_token()
+        finally:
+            await official_account.stop()
+            await server.stop()
+
+    asyncio.run(run())
+
+
+def test_queue_holds_messages_while_open(tmp_path) -> None:
+    """rejected by the open circuit is not counted as an attempt"""
+    rejections = {'count': 2}
+    sent: List[Dict[str, Any]] = []
+
+    async def sender(message: OutboundMessage) -> dict:
+        if rejections['count'] > 0:
+            rejections['count'] -= 1
+            raise CircuitOpenError('message', 0.01)
+        sent.append({'content': message.content['content'], 'attempts': message.attempts})
+        return {'errcode': 0, 'errmsg': 'ok'}
+
+    async def run():
+        queue = OutboundQueue(str(tmp_path), sender, OutboundQueueOption(
+            max_attempts=1, backoff_base=0.01, backoff_max=0.01, max_pending=1))
+        await queue.start()
+        key = queue.put('openid', 'text', {'content': 'hi'})
+        with pytest.raises(WechatyPuppetError):
+            queue.put('openid', 'text', {'content': 'shed'})
+        await queue.join()
+        await queue.stop()
+        return queue, key
+
+    queue, key = asyncio.run(run())
+    assert queue.is_sent(key)
+    assert sent == [{'content': 'hi', 'attempts': 0}]
+    assert not queue.dead_letters()
+
+
+def test_queue_sheds_while_open(tmp_path) -> None:
+    """new messages are rejected and the held ones are dead-lettered"""
+    # the circuit keeps open longer than max_hold
+    breaker = CircuitBreaker('message', CircuitBreakerOption(failure_threshold=2, recovery_timeout=10))
+
+    async def sender(_: OutboundMessage) -> dict:
+        return await breaker.call(fail)
+
+    async def fail() -> dict:
+        raise WechatyPuppetError('boom')
+
+    async def run():
+        queue = OutboundQueue(str(tmp_path), sender, OutboundQueueOption(
+            max_attempts=10, backoff_base=0.01, backoff_max=0.01, max_hold=0.3), breaker=breaker)
+        await queue.start()
+        key = queue.put('openid', 'text', {'content': 'hi'})
+        while not breaker.is_open:
+            await asyncio.sleep(0.01)
+        with pytest.raises(CircuitOpenError):
+            queue.put('openid', 'text', {'content': 'shed'})
+        await queue.join()
+        await queue.stop()
+        return queue, key
+
+    queue, key = asyncio.run(run())
+    assert not queue.is_sent(key)
+    assert len(queue) == 0
+    assert [message.last_error for message in queue.dead_letters()] == ['circuit is open']
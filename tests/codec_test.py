@@ -0,0 +1,117 @@
+"""
+Unit Test for the codec of the DataStore
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional
+
+import pytest   # type: ignore
+from wechaty_puppet import ContactGender, WechatyPuppetOperationError
+
+from wechaty_puppet_official_account.codec import BinaryCodec, default_codec
+from wechaty_puppet_official_account.data_store import DataStore, DataStoreOption
+from wechaty_puppet_official_account.schema import (
+    AccessTokenPayload,
+    OAContactPayload,
+    OAMessagePayload
+)
+
+
+def test_binary_codec() -> None:
+    """the payloads and the plain values are encoded losslessly"""
+    codec = default_codec()
+    payload = OAMessagePayload(
+        ToUserName='to', FromUserName='from', CreateTime='1600000000',
+        MsgType='text', Content='你好', MsgId='1'
+    )
+    token = AccessTokenPayload(expires_in=7200, refresh_time=datetime.now(), token='token')
+    plain = {'list': [1, -1, 2.5, None, True, b'bytes'], 'text': 'text'}
+
+    for value in [payload, token, plain]:
+        assert codec.decode(codec.encode(value)) == value
+
+
+def test_enum_and_mismatched_values() -> None:
+    """the enum fields keep their types, the values not matching the hints still round trip"""
+    codec = default_codec()
+    contact = OAContactPayload(
+        subscribe=1, openid='openid', nickname='昵称', sex=ContactGender.CONTACT_GENDER_MALE,
+        language='zh_CN', city='', province='', country='', headimgurl='', subscribe_time=1600000000,
+        unionid='', remark='', groupid=0, tagid_list=[1, 2], subscribe_scene='ADD_SCENE_QR_CODE',
+        qr_scene=0, qr_scene_str=''
+    )
+    decoded = codec.decode(codec.encode(contact))
+    assert decoded == contact
+    assert isinstance(decoded.sex, ContactGender)
+
+    # None in the str field falls back to writing the fields value by value
+    payload = OAMessagePayload(
+        ToUserName='to', FromUserName='from', CreateTime='1600000000',
+        MsgType='text', Content=None, MsgId='1'  # type: ignore
+    )
+    assert codec.decode(codec.encode(payload)) == payload
+
+
+def test_truncated_record() -> None:
+    """the corrupted records raise WechatyPuppetOperationError"""
+    codec = default_codec()
+    token = AccessTokenPayload(expires_in=7200, refresh_time=datetime.now(), token='token')
+    plain = {'list': [1, 2, 3]}
+    for data in [codec.encode(token), codec.encode(plain)]:
+        for size in range(len(data)):
+            with pytest.raises(WechatyPuppetOperationError):
+                codec.decode(data[:size])
+        with pytest.raises(WechatyPuppetOperationError):
+            codec.decode(data + b'\x00')
+
+
+@dataclass
+class _PayloadV1:
+    name: str
+
+
+@dataclass
+class _PayloadV2:
+    name: str
+    nickname: str
+
+
+@dataclass
+class _PayloadV3:
+    name: str
+    nickname: str
+    tags: Optional[List[str]]
+    score: float
+
+
+def test_upgrade_lazily(tmp_path) -> None:
+    """the old records are upgraded on reading"""
+    codec_v1 = BinaryCodec()
+    codec_v1.register(_PayloadV1, tag=1, version=1)
+    data_store = DataStore(DataStoreOption(cache_dir=str(tmp_path), codec=codec_v1))
+    data_store.set('payload', _PayloadV1(name='wechaty'))
+
+    # the field is appended to the dataclass in version 2
+    codec_v2 = BinaryCodec()
+    codec_v2.register(_PayloadV2, tag=1, version=2)
+    codec_v2.register_upgrader(_PayloadV2, 1, lambda payload: dict(payload, nickname=payload['name']))
+    data_store.option.codec = codec_v2
+
+    assert data_store.get('payload') == _PayloadV2(name='wechaty', nickname='wechaty')
+    assert data_store.get('payload') == _PayloadV2(name='wechaty', nickname='wechaty')
+
+
+def test_upgrade_compiled_record() -> None:
+    """the records are decoded by their own shapes and upgraded step by step"""
+    codec_v2 = BinaryCodec()
+    codec_v2.register(_PayloadV2, tag=1, version=2)
+    data = codec_v2.encode(_PayloadV2(name='wechaty', nickname='bot'))
+
+    codec_v3 = BinaryCodec()
+    codec_v3.register(_PayloadV3, tag=1, version=3)
+    codec_v3.register_upgrader(_PayloadV3, 2, lambda payload: dict(payload, tags=None, score=0.5))
+    assert codec_v3.is_stale(data)
+    assert codec_v3.decode(data) == _PayloadV3(name='wechaty', nickname='bot', tags=None, score=0.5)
+
+    payload = _PayloadV3(name='wechaty', nickname='bot', tags=['a'], score=1)
+    assert codec_v3.decode(codec_v3.encode(payload)) == payload
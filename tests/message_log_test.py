@@ -0,0 +1,53 @@
+"""
+Unit Test for the indexed message log
+"""
+from wechaty_puppet_official_account.message_log import MessageLog, MessageLogOption
+from wechaty_puppet_official_account.schema import OAMessagePayload
+
+
+def _payload(msg_id: int, from_user: str, msg_type: str, create_time: int) -> OAMessagePayload:
+    return OAMessagePayload(
+        ToUserName='official-account',
+        FromUserName=from_user,
+        CreateTime=str(create_time),
+        MsgType=msg_type,
+        Content=f'content-{msg_id}',
+        MsgId=str(msg_id)
+    )
+
+
+def test_search_message_log(tmp_path) -> None:
+    """the messages are found by the indexes, also after reopening the log"""
+    message_log = MessageLog(str(tmp_path), MessageLogOption(segment_bytes=512))
+    for msg_id in range(20):
+        payload = _payload(msg_id, f'user-{msg_id % 2}', 'text' if msg_id % 4 else 'image', 1000 + msg_id)
+        assert message_log.append(payload)
+    # the webhook may receive the same message several times
+    assert not message_log.append(_payload(3, 'user-1', 'text', 1003))
+    # the message which arrives late is still sorted by CreateTime
+    message_log.append(_payload(20, 'user-0', 'text', 999))
+    message_log.close()
+
+    message_log = MessageLog(str(tmp_path))
+    assert len(message_log) == 21
+    assert message_log.search(from_user='user-1', msg_type='text')[:2] == ['1', '3']
+    assert message_log.search(msg_type='image', since=1004, until=1008) == ['4', '8']
+    assert message_log.search(since=999, until=1001) == ['20', '0', '1']
+    # the messages of several types are merged by CreateTime
+    assert message_log.search(msg_type=['image', 'text'], since=1003, until=1005) == ['3', '4', '5']
+    assert message_log.search(msg_type=[]) == []
+    assert message_log.get('7').Content == 'content-7'
+
+
+def test_compact_message_log(tmp_path) -> None:
+    """the old segments are dropped with their indexes"""
+    option = MessageLogOption(segment_bytes=512, max_age=100)
+    message_log = MessageLog(str(tmp_path), option)
+    for msg_id in range(20):
+        message_log.append(_payload(msg_id, 'user', 'text', 1000 + msg_id * 10))
+
+    dropped = message_log.compact(now=1000 + 150)
+    assert dropped > 0
+    assert len(message_log) == 20 - dropped
+    assert '0' not in message_log
+    assert message_log.search(from_user='user')[0] == str(dropped)
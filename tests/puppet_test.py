@@ -0,0 +1,76 @@
+"""
+Unit Test for the message apis of the puppet
+"""
+# pylint: disable=W0621
+import asyncio
+
+import pytest   # type: ignore
+from wechaty_puppet import MessageQueryFilter, MessageType
+
+from wechaty_puppet_official_account.puppet import (
+    OfficialAccountPuppet,
+    OfficialAccountPuppetOptions
+)
+from wechaty_puppet_official_account.schema import OAMessagePayload
+
+
+@pytest.fixture
+def puppet(tmp_path) -> OfficialAccountPuppet:
+    """the puppet with the messages from alice & bob"""
+    puppet = OfficialAccountPuppet(OfficialAccountPuppetOptions(
+        app_id='app-id', app_secret='app-secret', token='token', port=8080, cache_dir=str(tmp_path)
+    ))
+    messages = [
+        ('1', 'alice', 'text', 'hello', 1003),
+        ('2', 'alice', 'shortvideo', '', 1001),
+        ('3', 'bob', 'video', '', 1002),
+        ('4', 'alice', 'video', '', 1004),
+        ('5', 'bob', 'text', 'hello world', 1005),
+    ]
+    for msg_id, from_user, msg_type, content, create_time in messages:
+        puppet.oa.message_log.append(OAMessagePayload(
+            ToUserName='official-account' if msg_id != '5' else 'other-account',
+            FromUserName=from_user,
+            CreateTime=str(create_time),
+            MsgType=msg_type,
+            Content=content,
+            MsgId=msg_id
+        ))
+    return puppet
+
+
+def _search(puppet: OfficialAccountPuppet, **kwargs) -> list:
+    return asyncio.run(puppet.message_search(MessageQueryFilter(**kwargs)))
+
+
+def test_message_search_by_type(puppet) -> None:
+    """video & shortvideo are both MESSAGE_TYPE_VIDEO, sorted by CreateTime"""
+    assert _search(puppet, type=MessageType.MESSAGE_TYPE_VIDEO) == ['2', '3', '4']
+    assert _search(puppet, type=MessageType.MESSAGE_TYPE_VIDEO, from_id='alice') == ['2', '4']
+    assert _search(puppet, type=MessageType.MESSAGE_TYPE_IMAGE) == []
+
+
+def test_message_search_by_id(puppet) -> None:
+    """the id hit is also checked by the other filters"""
+    assert _search(puppet, id='1') == ['1']
+    assert _search(puppet, id='1', from_id='alice') == ['1']
+    assert _search(puppet, id='1', from_id='bob') == []
+    assert _search(puppet, id='1', type=MessageType.MESSAGE_TYPE_VIDEO) == []
+    assert _search(puppet, id='1', text='bye') == []
+    assert _search(puppet, id='404') == []
+
+
+def test_message_search_by_payload(puppet) -> None:
+    """text & to_id are filtered by the payloads"""
+    assert _search(puppet, text='hello') == ['1', '5']
+    assert _search(puppet, text='hello', to_id='official-account') == ['1']
+    assert _search(puppet, room_id='room') == []
+
+
+def test_message_payload(puppet) -> None:
+    """the payload is converted from the message log"""
+    payload = asyncio.run(puppet.message_payload('2'))
+    assert payload.type == MessageType.MESSAGE_TYPE_VIDEO
+    assert payload.from_id == 'alice'
+    assert payload.to_id == 'official-account'
+    assert payload.timestamp == 1001
@@ -0,0 +1,72 @@
+"""
+Unit Test for the parametric qr code service
+"""
+import asyncio
+from typing import List
+
+import pytest   # type: ignore
+
+from wechaty_puppet import WechatyPuppetOperationError
+from wechaty_puppet_official_account.qr_code import QRCodeService
+from wechaty_puppet_official_account.webhook import parse_payload
+
+
+def test_create_batch(tmp_path) -> None:
+    """the qr codes are created once per scene with bounded concurrency"""
+    bodies: List[dict] = []
+    in_flight = {'current': 0, 'max': 0}
+
+    async def creator(body: dict) -> dict:
+        bodies.append(body)
+        in_flight['current'] += 1
+        in_flight['max'] = max(in_flight['max'], in_flight['current'])
+        await asyncio.sleep(0.01)
+        in_flight['current'] -= 1
+        scene = body['action_info']['scene']
+        if scene.get('scene_id') == 13:
+            return {'errcode': 40053, 'errmsg': 'invalid action info'}
+        return {'ticket': f'ticket-{scene}', 'url': f'http://weixin.qq.com/q/{scene}', 'expire_seconds': 3600}
+
+    service = QRCodeService(str(tmp_path), creator, concurrency=4)
+    scenes = list(range(1, 21)) + [1, 2]
+    results = asyncio.run(service.create_batch(scenes, expire_seconds=3600))
+
+    assert in_flight['max'] <= 4
+    assert len(bodies) == 20
+    assert results[12] is None
+    assert results[0] == results[-2]
+    assert service.cached(20, expire_seconds=3600).ticket == results[19].ticket
+    assert bodies[0] == {
+        'action_name': 'QR_SCENE',
+        'expire_seconds': 3600,
+        'action_info': {'scene': {'scene_id': 1}}
+    }
+
+    with pytest.raises(WechatyPuppetOperationError):
+        asyncio.run(service.create(200000, expire_seconds=None))
+
+
+def test_attribute(tmp_path) -> None:
+    """the subscribe & SCAN events are attributed to the scenes"""
+    async def creator(_: dict) -> dict:
+        return {}
+
+    service = QRCodeService(str(tmp_path), creator)
+
+    def event(name: str, event_key: str, create_time: str = '1600000000'):
+        return parse_payload({
+            'ToUserName': 'official-account', 'FromUserName': 'user', 'CreateTime': create_time,
+            'MsgType': 'event', 'Event': name, 'EventKey': event_key, 'Ticket': 'ticket'
+        })
+
+    assert service.attribute(event('subscribe', 'qrscene_campaign')) == 'campaign'
+    assert service.attribute(event('SCAN', 'campaign')) == 'campaign'
+    assert service.attribute(event('CLICK', 'MENU')) is None
+    assert service.scene_stats('campaign') == {'scan': 1, 'subscribe': 1}
+
+    # the retried push is counted once, the later scan is counted again
+    assert service.attribute(event('SCAN', 'campaign')) == 'campaign'
+    assert service.scene_stats('campaign') == {'scan': 1, 'subscribe': 1}
+    service.attribute(event('SCAN', 'campaign', create_time='1600000100'))
+    assert service.scene_stats('campaign') == {'scan': 2, 'subscribe': 1}
+    assert service.scene_of('user') == 'campaign'
@@ -0,0 +1,143 @@
+"""
+Unit Test for the routing table of the webhook
+"""
+import asyncio
+
+from wechaty_puppet_official_account.router import (
+    Router,
+    has_numeric_reference,
+    literal_prefix,
+    required_literal
+)
+from wechaty_puppet_official_account.schema import OAMessagePayload
+from wechaty_puppet_official_account.webhook import parse_payload
+
+
+def _reply(text: str):
+    async def handler(_) -> str:
+        return text
+    return handler
+
+
+def _text(content: str) -> OAMessagePayload:
+    return parse_payload({
+        'ToUserName': 'official-account', 'FromUserName': 'user', 'CreateTime': '1600000000',
+        'MsgType': 'text', 'Content': content, 'MsgId': '1'
+    })
+
+
+def test_literal_prefix() -> None:
+    """the literal prefix is what the matched text must start with"""
+    assert literal_prefix(r'order\d+') == 'order'
+    assert literal_prefix('orders?') == 'order'
+    assert literal_prefix('a|b') == ''
+    assert literal_prefix('(?i:hello)') == ''
+
+
+def test_required_literal() -> None:
+    """the longest literal at the top level, the groups, classes & optional chars are skipped"""
+    assert required_literal(r'(?i:order)-12-\d+$') == '-12-'
+    assert required_literal(r'[a-z]+ab+cd\.e') == 'cd.e'
+    assert required_literal(r'x(abcdef)?y[abcdef]z') == 'x'
+    assert required_literal(r'abc?d{2}') == 'ab'
+    assert required_literal(r'(a|b)cde') == 'cde'
+    assert required_literal(r'abcd|efgh') == ''
+    assert required_literal(r'(?i)abcd') == ''
+    assert required_literal(r'\x41bcd') == ''
+
+
+def test_numeric_reference() -> None:
+    """backreferences & conditionals by group number, but not the escapes"""
+    assert has_numeric_reference(r'x(b)\1')
+    assert has_numeric_reference(r'(a)?(?(1)b|c)')
+    assert not has_numeric_reference(r'x\\1')
+    assert not has_numeric_reference(r'(?P<a>b)(?P=a)\d')
+
+
+def test_route_text() -> None:
+    """keyword > regex > longest prefix > default"""
+    router = Router()
+    router.keyword('help', _reply('keyword'))
+    router.prefix('he', _reply('short prefix'))
+    router.prefix('hello', _reply('long prefix'))
+    router.regex(r'hello (?P<name>\w+)$', _reply('regex'))
+    router.regex(r'(?i:HELLO) world', _reply('case insensitive regex'))
+    router.default(_reply('default'))
+
+    def dispatch(content: str) -> str:
+        return asyncio.run(router.dispatch(_text(content)))
+
+    assert dispatch('help') == 'keyword'
+    assert dispatch('hello wechaty') == 'regex'
+    assert dispatch('HeLLo world') == 'case insensitive regex'
+    assert dispatch('hello!') == 'long prefix'
+    assert dispatch('hey') == 'short prefix'
+    assert dispatch('bye') == 'default'
+
+
+def test_route_event() -> None:
+    """events are routed by event key, then by event"""
+    router = Router()
+    router.event('CLICK', _reply('menu'), key='MENU_HELP')
+    router.event('click', _reply('any menu'))
+
+    def dispatch(event_key: str) -> str:
+        payload = parse_payload({
+            'ToUserName': 'official-account', 'FromUserName': 'user', 'CreateTime': '1600000000',
+            'MsgType': 'event', 'Event': 'CLICK', 'EventKey': event_key, 'MenuId': '1'
+        })
+        return asyncio.run(router.dispatch(payload))
+
+    assert dispatch('MENU_HELP') == 'menu'
+    assert dispatch('MENU_OTHER') == 'any menu'
+
+
+def test_route_uncombinable_regex() -> None:
+    """the regexes which can not be combined are matched one by one"""
+    router = Router()
+    router.regex(r'hello (?P<name>[a-z]+)$', _reply('name'))
+    router.regex(r'hello (?P<name>\d+)', _reply('number'))
+    router.regex(r'x(b)\1', _reply('backreference'))
+    router.regex(r'x(a)(b)\2', _reply('second backreference'))
+    router.default(_reply('default'))
+
+    def dispatch(content: str) -> str:
+        return asyncio.run(router.dispatch(_text(content)))
+
+    assert dispatch('hello wechaty') == 'name'
+    assert dispatch('hello 1') == 'number'
+    assert dispatch('xbb') == 'backreference'
+    assert dispatch('xbc') == 'default'
+    assert dispatch('xabb') == 'second backreference'
+    assert dispatch('xaba') == 'default'
+
+    # the later registered rule joins the bucket which is matched one by one
+    router.regex(r'hello (?P<name>!+)', _reply('exclamation'))
+    assert dispatch('hello !!') == 'exclamation'
+    assert dispatch('hello 1') == 'number'
+
+
+def test_route_large_bucket() -> None:
+    """the rules without literal prefix are prefiltered, the earlier registered one wins"""
+    router = Router()
+    for index in range(1000):
+        router.regex(rf'(?i:order)-{index}-\d+$', _reply(f'order {index}'))
+    # no literal to be indexed by, and the same group name in the chunk
+    router.regex(r'(?P<kind>[a-z]+)-7-\d+$', _reply('any kind'))
+    router.regex(r'(?P<kind>\d+)$', _reply('digits'))
+    router.regex(r'(?i:ORDER)-77-1$', _reply('late order'))
+    router.regex(r'[a-z]+-\d+-1$', _reply('any order'))
+    router.default(_reply('default'))
+
+    def dispatch(content: str) -> str:
+        return asyncio.run(router.dispatch(_text(content)))
+
+    assert dispatch('ORDER-999-20200101') == 'order 999'
+    assert dispatch('order-7-1') == 'order 7'
+    assert dispatch('refund-7-1') == 'any kind'
+    assert dispatch('20200101') == 'digits'
+    assert dispatch('order-77-1') == 'order 77'
+    assert dispatch('order-500-1') == 'order 500'
+    assert dispatch('refund-500-1') == 'any order'
+    assert dispatch('order-1000-2') == 'default'
+    assert dispatch('order-999-') == 'default'
@@ -0,0 +1,86 @@
+"""
+Unit Test for the outbound send queue
+"""
+# pylint: disable=W0621
+import asyncio
+from typing import List
+
+import pytest   # type: ignore
+
+from wechaty_puppet_official_account.send_queue import (
+    OutboundMessage,
+    OutboundQueue,
+    OutboundQueueOption,
+    is_retryable
+)
+
+
+@pytest.fixture
+def option() -> OutboundQueueOption:
+    """no backoff in unit tests"""
+    return OutboundQueueOption(max_attempts=3, backoff_base=0, backoff_max=0)
+
+
+def test_errcode_classification() -> None:
+    """system busy and quota are retryable, out of window is not"""
+    assert is_retryable(-1)
+    assert is_retryable(45009)
+    assert not is_retryable(45015)
+
+
+def test_retry_and_ordering(tmp_path, option) -> None:
+    """messages of the same openid are sent in order with retries"""
+    sent: List[str] = []
+    failures = {'first': 2}
+
+    async def sender(message: OutboundMessage) -> dict:
+        text = message.content['content']
+        if failures.get(text, 0) > 0:
+            failures[text] -= 1
+            return {'errcode': -1, 'errmsg': 'system busy'}
+        sent.append(text)
+        return {'errcode': 0, 'errmsg': 'ok'}
+
+    async def run():
+        queue = OutboundQueue(str(tmp_path), sender, option)
+        await queue.start()
+        first = queue.put('openid', 'text', {'content': 'first'})
+        queue.put('openid', 'text', {'content': 'second'})
+        await queue.join()
+        await queue.stop()
+        return queue, first
+
+    queue, first = asyncio.run(run())
+    assert sent == ['first', 'second']
+    assert queue.is_sent(first)
+    assert len(queue) == 0
+
+
+def test_permanent_error_and_restart(tmp_path, option) -> None:
+    """pending messages survive restarts, permanent errors are dead letters"""
+    sent: List[str] = []
+
+    async def sender(message: OutboundMessage) -> dict:
+        if message.openid == 'outside-window':
+            return {'errcode': 45015, 'errmsg': 'response out of time limit'}
+        sent.append(message.id)
+        return {'errcode': 0}
+
+    # queue the messages without delivering them, as if the process crashed
+    queue = OutboundQueue(str(tmp_path), sender, option)
+    queue.put('outside-window', 'text', {'content': 'hi'}, idempotency_key='a')
+    queue.put('user', 'text', {'content': 'hi'}, idempotency_key='b')
+
+    async def run():
+        restarted = OutboundQueue(str(tmp_path), sender, option)
+        await restarted.start()
+        await restarted.join()
+        # the sent message must not be sent twice
+        restarted.put('user', 'text', {'content': 'hi'}, idempotency_key='b')
+        await restarted.join()
+        await restarted.stop()
+        return restarted
+
+    restarted = asyncio.run(run())
+    assert sent == ['b']
+    assert [message.id for message in restarted.dead_letters()] == ['a']
@@ -0,0 +1,57 @@
+"""
+Unit Test for the customer service window tracker
+"""
+import time
+
+from diskcache import Cache
+
+from wechaty_puppet_official_account.data_store import DataStore, DataStoreOption
+from wechaty_puppet_official_account.service_window import ServiceWindow
+
+
+def _window(tmp_path) -> ServiceWindow:
+    return ServiceWindow(DataStore(DataStoreOption(cache_dir=str(tmp_path))))
+
+
+def test_service_window(tmp_path) -> None:
+    """the window is open in 48 hours after the last interaction"""
+    window = _window(tmp_path)
+    now = int(time.time())
+
+    assert not window.is_open('unknown')
+
+    window.touch('user', now - 47 * 3600)
+    assert window.is_open('user')
+    assert not window.is_open('user', now=now + 3600 + 1)
+
+    # the older interaction must not move the window back
+    window.touch('user', now - 50 * 3600)
+    assert window.last_interaction('user') == now - 47 * 3600
+
+    # the index survives restarts
+    assert _window(tmp_path).is_open('user')
+
+    # the older interaction must not overwrite the newer one on disk after restarts
+    window.touch('restart', now - 60)
+    restarted = _window(tmp_path)
+    restarted.touch('restart', now - 47 * 3600)
+    assert restarted.last_interaction('restart') == now - 60
+    assert _window(tmp_path).last_interaction('restart') == now - 60
+
+    window.touch('stale', now - 49 * 3600)
+    assert not window.is_open('stale')
+    window.evict()
+    assert window.last_interaction('stale') is None
+
+
+def test_migrate(tmp_path) -> None:
+    """the windows in the diskcache of the previous versions are moved into the store"""
+    now = int(time.time())
+    directory = str(tmp_path / 'service_window')
+    with Cache(directory) as cache:
+        cache.set('user', now - 60)
+
+    window = _window(tmp_path / 'store')
+    window.migrate(directory)
+    assert window.is_open('user')
+    assert _window(tmp_path / 'store').last_interaction('user') == now - 60
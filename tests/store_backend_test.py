@@ -0,0 +1,111 @@
+"""
+Unit Test for the backends of the DataStore
+"""
+# pylint: disable=W0621
+import threading
+import time
+from datetime import datetime
+from typing import List
+
+import pytest   # type: ignore
+
+from wechaty_puppet import WechatyPuppetOperationError
+from wechaty_puppet_official_account.data_store import DataStore, DataStoreOption
+from wechaty_puppet_official_account.official_account import (
+    OfficialAccount,
+    OfficialAccountOption
+)
+from wechaty_puppet_official_account.schema import AccessTokenPayload, OAMessagePayload
+from wechaty_puppet_official_account.service_window import ServiceWindow
+from wechaty_puppet_official_account.store_backend import (
+    DiskCacheBackend,
+    RedisBackend,
+    StoreBackend
+)
+
+
+@pytest.fixture(params=['diskcache', 'redis'])
+def backend(request, tmp_path) -> StoreBackend:
+    """the local backend and the redis backend on fakeredis"""
+    if request.param == 'diskcache':
+        return DiskCacheBackend(str(tmp_path / 'backend'))
+    fakeredis = pytest.importorskip('fakeredis')
+    return RedisBackend(fakeredis.FakeRedis())
+
+
+def test_share_payload(backend, tmp_path) -> None:
+    """the instances on the same backend share the access token"""
+    first = DataStore(DataStoreOption(cache_dir=str(tmp_path / 'first'), backend=backend))
+    second = DataStore(DataStoreOption(cache_dir=str(tmp_path / 'second'), backend=backend))
+
+    payload = AccessTokenPayload(expires_in=7200, refresh_time=datetime.now(), token='token')
+    first.set_access_token_payload(payload)
+    assert second.get_access_token_payload() == payload
+
+
+def test_share_service_window(backend, tmp_path) -> None:
+    """the window opened by the message received by the other instance"""
+    first = ServiceWindow(DataStore(DataStoreOption(cache_dir=str(tmp_path / 'first'), backend=backend)))
+    second = ServiceWindow(DataStore(DataStoreOption(cache_dir=str(tmp_path / 'second'), backend=backend)))
+    now = int(time.time())
+
+    second.touch('user', now - 48 * 3600 + 60)
+    assert second.is_open('user')
+    first.touch('user', now)
+    # the window closed in memory is checked against the store again
+    assert second.is_open('user', now=now + 120)
+    second.touch('user', now - 60)
+    assert first.last_interaction('user') == now
+
+
+def test_share_message_payload(backend, tmp_path) -> None:
+    """the message received by the other instance is found by id"""
+    def official_account(name: str) -> OfficialAccount:
+        return OfficialAccount(OfficialAccountOption(
+            app_id='app-id', app_secret='app-secret', port=8080, token='token',
+            cache_dir=str(tmp_path / name), store_backend=backend
+        ))
+
+    first, second = official_account('first'), official_account('second')
+    payload = OAMessagePayload(ToUserName='official-account', FromUserName='user',
+                               CreateTime='1000', MsgType='text', Content='hello', MsgId='1')
+    first.message_log.append(payload)
+    first._data_store.set_message_payload(payload.MsgId, payload, expire=60)
+
+    assert second.message_payload('1') == payload
+    # the local index does not cover the messages of the others
+    assert second.message_log.search(from_user='user') == []
+    with pytest.raises(WechatyPuppetOperationError):
+        second.message_payload('404')
+
+
+def test_redis_socket_timeout() -> None:
+    """the redis commands fail instead of blocking the event loop"""
+    pytest.importorskip('redis')
+    backend = RedisBackend.from_url('redis://localhost:6379/0', socket_timeout=1.5)
+    connection_kwargs = backend._client.connection_pool.connection_kwargs
+    assert connection_kwargs['socket_timeout'] == 1.5
+    assert connection_kwargs['socket_connect_timeout'] == 1.5
+
+
+def test_lock(backend) -> None:
+    """the lock is held by one holder at a time"""
+    holders: List[int] = []
+
+    def hold(index: int):
+        with backend.lock('access_token', timeout=5, blocking_timeout=5):
+            holders.append(index)
+            time.sleep(0.1)
+            holders.append(index)
+
+    threads = [threading.Thread(target=hold, args=(index,)) for index in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # the enter & exit of each holder are not interleaved
+    assert [holders[index] for index in range(0, 6, 2)] == [holders[index] for index in range(1, 6, 2)]
+
+    with backend.lock('access_token', timeout=5):
+        with pytest.raises(WechatyPuppetOperationError):
+            backend.lock('access_token', blocking_timeout=0.1).acquire()
@@ -0,0 +1,83 @@
+"""
+Unit Test for the pre-compiled template message
+"""
+import asyncio
+import json
+
+import pytest   # type: ignore
+
+from wechaty_puppet import WechatyPuppetOperationError
+from wechaty_puppet_official_account.official_account import (
+    OfficialAccount,
+    OfficialAccountOption
+)
+from wechaty_puppet_official_account.template import MessageTemplate
+
+
+def test_render_template() -> None:
+    """the rendered body is the same as serializing the whole payload"""
+    template = MessageTemplate(
+        template_id='template-id',
+        fields=['first', 'keyword1', 'remark'],
+        url='https://wechaty.js.org',
+        colors={'keyword1': '#173177'}
+    )
+    body = template.render('openid', {'first': '你好', 'keyword1': '"quoted"', 'remark': 'bye'})
+    assert json.loads(body) == {
+        'touser': 'openid',
+        'template_id': 'template-id',
+        'url': 'https://wechaty.js.org',
+        'data': {
+            'first': {'value': '你好'},
+            'keyword1': {'value': '"quoted"', 'color': '#173177'},
+            'remark': {'value': 'bye'}
+        }
+    }
+
+
+def test_invalid_template() -> None:
+    """the template and the values are validated"""
+    with pytest.raises(WechatyPuppetOperationError):
+        MessageTemplate(template_id='template-id', fields=['first', 'first'])
+    with pytest.raises(WechatyPuppetOperationError):
+        MessageTemplate(template_id='template-id', fields=['first'], colors={'remark': '#000000'})
+
+    template = MessageTemplate(template_id='template-id', fields=['first', 'remark'])
+    with pytest.raises(WechatyPuppetOperationError):
+        template.render('openid', {'first': 'hello'})
+    with pytest.raises(WechatyPuppetOperationError):
+        template.render('openid', {'first': 'hello', 'other': 'bye'})
+
+
+def test_send_template_batch(tmp_path) -> None:
+    """bounded in-flight requests, ordered results and recorded msgids"""
+    official_account = OfficialAccount(OfficialAccountOption(
+        app_id='app-id', app_secret='app-secret', port=8080, token='token', cache_dir=str(tmp_path)
+    ))
+    official_account.register_template('notice', 'template-id', ['first'])
+    in_flight = {'current': 0, 'max': 0}
+
+    async def post(_: str, body: bytes) -> dict:
+        in_flight['current'] += 1
+        in_flight['max'] = max(in_flight['max'], in_flight['current'])
+        openid = json.loads(body)['touser']
+        index = int(openid.split('-')[1])
+        # the later recipients finish earlier
+        await asyncio.sleep(0.001 * (20 - index))
+        in_flight['current'] -= 1
+        if index == 3:
+            return {'errcode': 43004, 'errmsg': 'require subscribe'}
+        return {'errcode': 0, 'errmsg': 'ok', 'msgid': 1000 + index}
+
+    official_account._post = post  # type: ignore
+
+    recipients = [(f'user-{index}', {'first': str(index)}) for index in range(20)]
+    results = asyncio.run(official_account.send_template_batch('notice', recipients, concurrency=4))
+
+    assert in_flight['max'] == 4
+    assert [result.openid for result in results] == [openid for openid, _ in recipients]
+    assert results[3].msgid is None and results[3].errcode == 43004
+    assert results[5].msgid == 1005
+    sent = official_account.template_send_result(1005)
+    assert sent is not None and sent.openid == 'user-5'
+    assert official_account.template_send_result(1003) is None
@@ -0,0 +1,67 @@
+"""
+Unit Test for the webhook
+"""
+import asyncio
+import hashlib
+from typing import List
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from wechaty_puppet_official_account.webhook import Webhook, WebhookOptions, parse_xml
+
+
+def test_verify_auth() -> None:
+    """the signature is sha1 of the sorted token, timestamp and nonce"""
+    webhook = Webhook(WebhookOptions(port=80, token='token'))
+    signature = hashlib.sha1(''.join(sorted(['token', '1600000000', 'nonce'])).encode()).hexdigest()
+    query = {'signature': signature, 'timestamp': '1600000000', 'nonce': 'nonce', 'echostr': 'echo'}
+
+    assert webhook.verify_auth(query) == 'echo'
+    assert webhook.verify_auth(dict(query, signature='invalid')) == ''
+
+
+def test_parse_xml() -> None:
+    """the nested elements are parsed into dict"""
+    body = (
+        '<xml><MsgType><![CDATA[event]]></MsgType><Event><![CDATA[scancode_push]]></Event>'
+        '<ScanCodeInfo><ScanType><![CDATA[qrcode]]></ScanType><ScanResult><![CDATA[1]]></ScanResult></ScanCodeInfo>'
+        '</xml>'
+    ).encode('utf-8')
+    assert parse_xml(body) == {
+        'MsgType': 'event',
+        'Event': 'scancode_push',
+        'ScanCodeInfo': {'ScanType': 'qrcode', 'ScanResult': '1'}
+    }
+
+
+def test_receive_message_signature() -> None:
+    """the post with invalid signature is rejected before the body is handled"""
+    webhook = Webhook(WebhookOptions(port=80, token='token'))
+    received: List[str] = []
+
+    async def handler(payload) -> str:
+        received.append(payload.Content)
+        return 'pong'
+
+    webhook.router.keyword('ping', handler)
+
+    signature = hashlib.sha1(''.join(sorted(['token', '1600000000', 'nonce'])).encode()).hexdigest()
+    query = {'signature': signature, 'timestamp': '1600000000', 'nonce': 'nonce'}
+    body = (b'<xml><ToUserName>official-account</ToUserName><FromUserName>user</FromUserName>'
+            b'<CreateTime>1600000000</CreateTime><MsgType>text</MsgType>'
+            b'<Content>ping</Content><MsgId>1</MsgId></xml>')
+
+    async def run():
+        async with TestClient(TestServer(webhook.create_app())) as client:
+            forged = await client.post('/', params=dict(query, signature='forged'), data=body)
+            assert forged.status == 403
+            missing = await client.post('/', data=body)
+            assert missing.status == 403
+            assert not received
+
+            response = await client.post('/', params=query, data=body)
+            assert response.status == 200
+            assert '<Content>pong</Content>' in await response.text()
+            assert received == ['ping']
+
+    asyncio.run(run())